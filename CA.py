@@ -1,8 +1,10 @@
-from numpy.random import choice
-
 from floorfield import *
 from plotting import *
 from IO import save_floor_field
+from visibility import VisibilityIndex
+from sectors import SectorTemplates
+from step_pool import StepPool
+from step_kernel import StepKernel, NUMBA_AVAILABLE
 
 
 class CA:
@@ -10,19 +12,110 @@ class CA:
 
     :param static_ff: The underlying static floor field for all pedestrians
     :param simulation_parameters: The used simulation parameters (see class:SimulationParameters)
+    :param visibility: Cell to cell visibility index
+    :param sectors: Voronoi sector templates of the neighbors
+    :param point_weight: Distance weight of the floor field seen by a pedestrian
+    :param rng: Random number generator of the simulation
+    :param occupancy: Id of the pedestrian on each cell, -1 for free cells
+    :param ped_cells: True for cells containing a pedestrian, updated together with occupancy
+    :param step_pool: Worker processes computing the probabilities of the pedestrians, None for serial computation
+    :param step_kernel: Compiled kernel computing the next steps of the pedestrians, None for the NumPy computation
     """
     static_ff = None
     simulation_parameters: SimulationParameters
+    visibility: VisibilityIndex
+    sectors: SectorTemplates
+    point_weight: PointWeightKernel
+    rng: np.random.Generator
+    occupancy: np.ndarray
+    ped_cells: np.ndarray
+    step_pool: StepPool = None
+    step_kernel: StepKernel = None
+
+    # weight of pedestrians staying on their cell in conflicts, they almost always win
+    stay_weight = 1000000
 
-    def __init__(self, simulation_parameters: SimulationParameters, geometry: Geometry, grid: Grid):
+    def __init__(self, simulation_parameters: SimulationParameters, geometry: Geometry, grid: Grid,
+                 rng: np.random.Generator):
         """
         Init the CA.
         :param simulation_parameters: simulation parameters to use
         :param geometry: geometry to use
         :param grid: grid to use
+        :param rng: random number generator of the simulation
+        """
+        self.simulation_parameters = simulation_parameters
+        self.static_ff = compute_static_ff(geometry, grid, self.simulation_parameters)
+        self.visibility = VisibilityIndex(geometry, grid, self.simulation_parameters.cache_path)
+        self.sectors = SectorTemplates(grid)
+        self.point_weight = PointWeightKernel(grid)
+        self.rng = rng
+
+        self.occupancy = np.full(grid.gridX.shape, -1, dtype=int)
+        pos = geometry.pedestrians.positions()
+        self.occupancy[pos[:, 0], pos[:, 1]] = geometry.pedestrians.get_ids()
+        self.ped_cells = self.occupancy != -1
+
+        if self.simulation_parameters.step_kernel:
+            if NUMBA_AVAILABLE:
+                self.step_kernel = StepKernel(grid, self.visibility, self.sectors, self.point_weight, self.static_ff)
+            else:
+                print('numba is not installed, the next steps are computed with NumPy')
+
+        if self.simulation_parameters.step_workers > 1:
+            self.step_pool = StepPool(self, geometry, grid, self.simulation_parameters.step_workers)
+
+    def add_pedestrian(self, geometry: Geometry, pos: [int, int], direction: Neighbors, standing: bool, exit_id: int,
+                       ped_id: int = None):
+        """
+        Adds a new pedestrian to the simulation.
+        :param geometry: geometry to use
+        :param pos: cell of the pedestrian
+        :param direction: last moving direction
+        :param standing: pedestrian does not move
+        :param exit_id: exit the pedestrian is heading to
+        :param ped_id: id of the pedestrian, if None the next free id is used
+        :return: id of the new pedestrian
+        """
+        ped_id = geometry.pedestrians.add(pos, direction, standing, exit_id, ped_id)
+        self.occupancy[pos[0], pos[1]] = ped_id
+        self.ped_cells[pos[0], pos[1]] = True
+        return ped_id
+
+    def is_occupied(self, i: int, j: int):
+        """
+        :param i: 1st dimension index of cell
+        :param j: 2nd dimension index of cell
+        :return: cell (i, j) is occupied by a pedestrian
+        """
+        return self.occupancy[i, j] != -1
+
+    def update_parameters(self, simulation_parameters: SimulationParameters, geometry: Geometry, grid: Grid):
+        """
+        Updates the simulation parameters, the static floor field is recomputed from the cached distance fields.
+        :param simulation_parameters: simulation parameters to use
+        :param geometry: geometry to use
+        :param grid: grid to use
         """
         self.simulation_parameters = simulation_parameters
         self.static_ff = compute_static_ff(geometry, grid, self.simulation_parameters)
+        if self.step_kernel is not None:
+            self.step_kernel.set_static_ff(self.static_ff)
+
+        # the workers hold a copy of the old parameters
+        if self.step_pool is not None:
+            self.step_pool.close()
+            self.step_pool = None
+        if self.simulation_parameters.step_workers > 1:
+            self.step_pool = StepPool(self, geometry, grid, self.simulation_parameters.step_workers)
+
+    def close(self):
+        """
+        Stops the worker processes of the step pool.
+        """
+        if self.step_pool is not None:
+            self.step_pool.close()
+            self.step_pool = None
 
     def compute_step(self, geometry: Geometry, grid: Grid):
         """
@@ -30,100 +123,157 @@ class CA:
         :param geometry: geometry to use
         :param grid: grid to use
         """
-        next_step = {}
-        prob_next_step = {}
-        for ped_id, ped in geometry.pedestrians.items():
-            if ped.standing:
-                next_step[ped_id] = [Neighbors.self]
+        ped_ids = geometry.pedestrians.get_ids()
+
+        shared_ped_distance = None
+        if self.simulation_parameters.shared_ped_field and len(geometry.pedestrians) > 1:
+            shared_ped_distance = compute_shared_ped_distance(geometry, grid, self.ped_cells,
+                                                              self.simulation_parameters.ped_distance_backend)
+
+        # the kernel needs the pedestrian distance as flat arrays, which are not available with one FMM per pedestrian
+        if self.step_kernel is not None and (shared_ped_distance is not None or len(ped_ids) <= 1):
+            probs, steps = self.step_kernel.compute_step(geometry, grid, self.simulation_parameters,
+                                                         shared_ped_distance, self.rng)
+        else:
+            if self.step_pool is None:
+                probs = self.compute_probs(geometry, grid, list(geometry.pedestrians.values()), shared_ped_distance)
             else:
-                individual_ff = compute_individual_ff(geometry, grid, ped, self.simulation_parameters)
-                combined = compute_overall_ff(geometry, grid, self.static_ff[ped.exit_id], individual_ff)
+                probs = self.step_pool.compute_probs(geometry, shared_ped_distance)
+            steps = self.compute_next_steps(probs, self.rng)
+        prob_steps = probs[np.arange(len(steps)), steps]
 
-                prob_neighbor = compute_prob_neighbors(geometry, grid, ped, combined, self.simulation_parameters.w_direction)
-                step = self.compute_next_step(prob_neighbor)
+        self.apply_step(geometry, grid, ped_ids, steps, prob_steps, self.occupancy, self.ped_cells, self.rng)
 
-                next_step[ped_id] = step
-                prob_next_step[ped_id] = prob_neighbor[step]
+    def compute_probs(self, geometry: Geometry, grid: Grid, peds, shared_ped_distance: SharedPedDistance = None):
+        """
+        Computes the probabilities of the neighboring fields of *peds*, only reads the state of the simulation.
+        :param geometry: geometry to use
+        :param grid: grid to use
+        :param peds: pedestrians to compute the probabilities for
+        :param shared_ped_distance: pedestrian distance information of the current step, if None the distance is
+                                    computed for each pedestrian
+        :return: Probabilities of the neighboring fields for each pedestrian, indexed by Neighbors value
+        """
+        probs = np.zeros((len(peds), len(Neighbors)))
+        for index, ped in enumerate(peds):
+            if ped.standing:
+                probs[index, Neighbors.self.value] = 1
+            else:
+                # the floor fields are only computed in the bounding box of the cells visible from the pedestrian
+                window, visible = self.visibility.visible_window(
+                    ped.i(), ped.j(), self.simulation_parameters.window_radius * MTOMM / grid.cellsize)
+                individual_ff = compute_individual_ff(geometry, grid, ped, self.simulation_parameters, self.ped_cells,
+                                                      shared_ped_distance, window)
+                combined = compute_overall_ff(geometry, grid, self.static_ff[ped.exit_id], individual_ff, window)
 
-        self.apply_step(geometry, grid, next_step, prob_next_step)
+                prob_neighbor = compute_prob_neighbors(geometry, grid, ped, combined,
+                                                       self.simulation_parameters.w_direction, self.visibility,
+                                                       self.sectors, self.point_weight,
+                                                       self.simulation_parameters.window_radius, (window, visible))
+                for key, prob in prob_neighbor.items():
+                    probs[index, key.value] = prob
+        return probs
 
     @staticmethod
-    def compute_next_step(prob):
+    def compute_next_steps(probs, rng: np.random.Generator):
         """
-        Chooses the next step based on *prob*.
-        :param prob: Probabilities for the corresponding neighboring fields
-        :return: Next step
+        Chooses the next step of all pedestrians based on *probs* with one inverse CDF draw.
+        :param probs: Probabilities of the neighboring fields for each pedestrian, indexed by Neighbors value
+        :param rng: random number generator of the simulation
+        :return: Next steps as Neighbors values
         """
-        keys = list(prob.keys())
-        probs = list(prob.values())
+        cdf = np.cumsum(probs, axis=1)
+        uniform = rng.random(len(probs)) * cdf[:, -1]
+        steps = np.sum(cdf <= uniform[:, None], axis=1)
 
-        return choice(keys, 1, p=probs)[0]
+        # rounding may not lead to neighbors with probability 0
+        last = probs.shape[1] - 1 - np.argmax(probs[:, ::-1] > 0, axis=1)
+        return np.minimum(steps, last)
 
     @staticmethod
-    def apply_step(geometry: Geometry, grid: Grid, next_step, prob_next_step):
+    def apply_step(geometry: Geometry, grid: Grid, ped_ids, steps, probs, occupancy, ped_cells,
+                   rng: np.random.Generator):
         """
         Applies the current step to pedestrians and resolves occurring conflicts.
         :param geometry: geometry to use
         :param grid: grid to use
-        :param next_step: next steps of all pedestrians
-        :param prob_next_step: probabilities of next steps
+        :param ped_ids: ids of the pedestrians
+        :param steps: next steps of the pedestrians as Neighbors values
+        :param probs: probabilities of next steps
+        :param occupancy: id of the pedestrian on each cell, updated for the moving pedestrians
+        :param ped_cells: True for cells containing a pedestrian, updated for the moving pedestrians
+        :param rng: random number generator of the simulation
         """
-        targets = {}
-        for key, step in next_step.items():
-            neighbors = grid.get_neighbors(geometry, geometry.pedestrians[key].pos)
-            targets[key] = neighbors[step]
+        rows = geometry.pedestrians.row_of(ped_ids)
+
+        # pedestrians only choose available neighbors, hence the target is always in the adjacency table
+        current = geometry.pedestrians.pos[rows]
+        current_flat = grid.flat_index(current[:, 0], current[:, 1])
+        targets_flat = grid.adjacency[current_flat, steps]
 
-        conflicts = CA.find_conflicts(targets)
-        CA.solve_conflicts(geometry, targets, next_step, prob_next_step, conflicts)
+        weights = np.where(steps == Neighbors.self.value, CA.stay_weight, probs)
+        order, starts, counts = CA.find_conflicts(targets_flat)
+        losers = CA.solve_conflicts(weights, order, starts, counts, rng)
+        targets_flat[losers] = current_flat[losers]
 
-        for key, target in targets.items():
-            geometry.pedestrians[key].set_pos(target)
+        # occupancy and ped_cells are contiguous, hence the reshaped arrays are views
+        moving = targets_flat != current_flat
+        occupancy_flat = occupancy.reshape(-1)
+        occupancy_flat[current_flat[moving]] = -1
+        occupancy_flat[targets_flat[moving]] = ped_ids[moving]
+        ped_cells_flat = ped_cells.reshape(-1)
+        ped_cells_flat[current_flat[moving]] = False
+        ped_cells_flat[targets_flat[moving]] = True
+
+        targets = np.column_stack(np.divmod(targets_flat, grid.dimY))
+        geometry.pedestrians.move_rows(rows, targets)
 
     @staticmethod
-    def solve_conflicts(geometry: Geometry, targets, next_step, prob_next_step, conflicts):
+    def solve_conflicts(weights, order, starts, counts, rng: np.random.Generator):
         """
-        Solves occurring conflicts by using relative probabilities
-        :param geometry: geometry to use
-        :param targets: target fields for each pedestrian
-        :param next_step: targeted field for each pedestrian
-        :param prob_next_step: probabilities of each targeted field
-        :param conflicts: conflicting targets
-        :return:
+        Solves occurring conflicts by using relative probabilities, the winners of all conflicts are drawn at once.
+        :param weights: weight of each pedestrian to win a conflict
+        :param order: indices of the pedestrians sorted by targeted cell (see find_conflicts)
+        :param starts: start of each conflict in order
+        :param counts: number of pedestrians in each conflict
+        :param rng: random number generator of the simulation
+        :return: indices of the pedestrians which lost a conflict and stay on their cell
         """
-        for conflict in conflicts:
-            probs = []
-            for ped_id in conflict:
-                if next_step[ped_id] == Neighbors.self:
-                    probs.append(1000000)
-                else:
-                    probs.append(prob_next_step[ped_id])
-            probs = [x / sum(probs) for x in probs]
-            c = choice(conflict, 1, p=probs)[0]
+        if len(counts) == 0:
+            return np.zeros(0, dtype=int)
+
+        # pedestrians involved in conflicts, grouped by conflict
+        ends = np.cumsum(counts)
+        positions = np.arange(ends[-1]) - np.repeat(ends - counts, counts) + np.repeat(starts, counts)
+        members = order[positions]
+
+        # weighted draw of one winner per conflict with the cumulative weights
+        cum_weights = np.cumsum(weights[members])
+        before = np.concatenate(([0], cum_weights))[ends - counts]
+        total = cum_weights[ends - 1] - before
+        winners = np.searchsorted(cum_weights, before + rng.random(len(counts)) * total, side='right')
+        winners = np.minimum(winners, ends - 1)
 
-            for ped_id in conflict:
-                if ped_id != c:
-                    targets[ped_id] = [geometry.pedestrians[ped_id].i(), geometry.pedestrians[ped_id].j()]
+        lost = np.ones(len(members), dtype=bool)
+        lost[winners] = False
+        return members[lost]
 
     @staticmethod
     def find_conflicts(targets):
         """
         Finds conflicts the *targets*, checks if two or more pedestrians target the same cell.
-        :param targets: Targeted cells
-        :return: Conflicting target cells
-        """
-        targets_list = list(targets.values())
-        duplicates = []
-        for key, target in targets.items():
-            if targets_list.count(target) > 1:
-                if duplicates.count(target) == 0:
-                    duplicates.append(target)
-
-        conflicts = []
-        for duplicate in duplicates:
-            indices = [i for i, x in enumerate(targets_list) if x == duplicate]
-            conflicts.append(indices)
-
-        return conflicts
+        :param targets: flat indices of the targeted cells
+        :return: indices of the pedestrians sorted by targeted cell, start and number of pedestrians of each conflict
+                 in the sorted indices
+        """
+        order = np.argsort(targets, kind='stable')
+        _, starts, counts = np.unique(targets[order], return_index=True, return_counts=True)
+
+        # conflicts in order of their first pedestrian
+        conflicting = counts > 1
+        starts, counts = starts[conflicting], counts[conflicting]
+        first = np.argsort(order[starts], kind='stable')
+        return order, starts[first], counts[first]
 
     def save(self, output_path):
         """
@@ -1,3 +1,6 @@
+import hashlib
+import json
+
 import numpy as np
 import os
 from xml.dom.minidom import parse
@@ -9,7 +12,7 @@ def read_geometry(filename):
     """
     Reads the geometry from filename
     :param filename: file containing geometry information
-    :return: geometrical features
+    :return: geometrical features and hash of the xml content
     """
     root = parse(filename)
     obstacles = read_obstacle(root)
@@ -17,7 +20,8 @@ def read_geometry(filename):
     entrances, entrances_properties = read_entrances(root)
     exits = read_exits(root)
     edges = read_subroom_edges(root)
-    return walls, obstacles, entrances, entrances_properties, exits, edges
+    geometry_hash = hashlib.sha1(root.toxml().encode('utf-8')).hexdigest()
+    return walls, obstacles, entrances, entrances_properties, exits, edges, geometry_hash
 
 
 def read_entrances(root):
@@ -38,8 +42,8 @@ def read_entrances(root):
 
         points = []
         for v_num, v_elem in enumerate(t_elem.getElementsByTagName('vertex')):
-            vertex_x = MTOMM * float(t_elem.getElementsByTagName('vertex')[v_num].attributes['px'].value)
-            vertex_y = MTOMM * float(t_elem.getElementsByTagName('vertex')[v_num].attributes['py'].value)
+            vertex_x = MTOMM * float(v_elem.attributes['px'].value)
+            vertex_y = MTOMM * float(v_elem.attributes['py'].value)
             points.append([vertex_x, vertex_y])
 
         entrances[door_id] = points
@@ -62,8 +66,8 @@ def read_exits(root):
 
         points = []
         for v_num, v_elem in enumerate(t_elem.getElementsByTagName('vertex')):
-            vertex_x = MTOMM * float(t_elem.getElementsByTagName('vertex')[v_num].attributes['px'].value)
-            vertex_y = MTOMM * float(t_elem.getElementsByTagName('vertex')[v_num].attributes['py'].value)
+            vertex_x = MTOMM * float(v_elem.attributes['px'].value)
+            vertex_y = MTOMM * float(v_elem.attributes['py'].value)
             points.append([vertex_x, vertex_y])
 
         exits[door_id] = points
@@ -86,8 +90,8 @@ def read_obstacle(xml_doc):
         points = []
         for p_num, p_elem in enumerate(o_elem.getElementsByTagName('polygon')):
             for v_num, v_elem in enumerate(p_elem.getElementsByTagName('vertex')):
-                vertex_x = MTOMM * float(p_elem.getElementsByTagName('vertex')[v_num].attributes['px'].value)
-                vertex_y = MTOMM * float(p_elem.getElementsByTagName('vertex')[v_num].attributes['py'].value)
+                vertex_x = MTOMM * float(v_elem.attributes['px'].value)
+                vertex_y = MTOMM * float(v_elem.attributes['py'].value)
                 points.append([vertex_x, vertex_y])
 
         obstacles[obstacle_id] = points
@@ -110,8 +114,8 @@ def read_subroom_edges(xml_doc):
 
             edge_points = []
             for v_num, v_elem in enumerate(p_elem.getElementsByTagName('vertex')):
-                x = MTOMM * float(p_elem.getElementsByTagName('vertex')[v_num].attributes['px'].value)
-                y = MTOMM * float(p_elem.getElementsByTagName('vertex')[v_num].attributes['py'].value)
+                x = MTOMM * float(v_elem.attributes['px'].value)
+                y = MTOMM * float(v_elem.attributes['py'].value)
                 edge_points.append([x, y])
 
             edge_segments.append([edge_points[0], edge_points[1]])
@@ -133,8 +137,8 @@ def read_subroom_walls(xml_doc):
                 n_wall = n_wall + 1
 
                 for v_num, v_elem in enumerate(p_elem.getElementsByTagName('vertex')):
-                    x = MTOMM * float(p_elem.getElementsByTagName('vertex')[v_num].attributes['px'].value)
-                    y = MTOMM * float(p_elem.getElementsByTagName('vertex')[v_num].attributes['py'].value)
+                    x = MTOMM * float(v_elem.attributes['px'].value)
+                    y = MTOMM * float(v_elem.attributes['py'].value)
                     wall_points.append([x, y])
 
     wall_segments = []
@@ -169,3 +173,70 @@ def save_floor_field(floor_field, output_path, filename):
     """
     ff_filename = os.path.join(output_path, filename)
     np.savetxt(ff_filename, floor_field)
+
+
+COMPLETION_MARKER = 'completed.json'
+"""File in the output directory marking a finished simulation."""
+
+
+def file_checksum(filename):
+    """
+    :param filename: file to check
+    :return: sha1 of the file content
+    """
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def write_completion_marker(output_path, parameter_hash):
+    """
+    Marks the simulation in output_path as finished, the marker contains the hash of the parameters and the checksums
+    of all files in the output directory.
+    :param output_path: path to the output directory
+    :param parameter_hash: hash of the simulation parameters (see SimulationParameters.hash)
+    """
+    outputs = {filename: file_checksum(os.path.join(output_path, filename))
+               for filename in sorted(os.listdir(output_path))
+               if filename != COMPLETION_MARKER and os.path.isfile(os.path.join(output_path, filename))}
+
+    marker_filename = os.path.join(output_path, COMPLETION_MARKER)
+    tmp_filename = '{}.tmp'.format(marker_filename)
+    with open(tmp_filename, 'w') as file:
+        json.dump({'parameter_hash': parameter_hash, 'outputs': outputs}, file, indent=1)
+    os.replace(tmp_filename, marker_filename)
+
+
+def remove_completion_marker(output_path):
+    """
+    Removes the completion marker, the simulation in output_path is not finished anymore.
+    :param output_path: path to the output directory
+    """
+    marker_filename = os.path.join(output_path, COMPLETION_MARKER)
+    if os.path.isfile(marker_filename):
+        os.remove(marker_filename)
+
+
+def is_completed(output_path, parameter_hash):
+    """
+    :param output_path: path to the output directory
+    :param parameter_hash: hash of the simulation parameters (see SimulationParameters.hash)
+    :return: the simulation with the given parameters finished in output_path and its outputs are unchanged
+    """
+    marker_filename = os.path.join(output_path, COMPLETION_MARKER)
+    try:
+        with open(marker_filename) as file:
+            marker = json.load(file)
+    except (OSError, ValueError):
+        return False
+
+    if marker.get('parameter_hash') != parameter_hash:
+        return False
+
+    for filename, checksum in marker.get('outputs', {}).items():
+        path = os.path.join(output_path, filename)
+        if not os.path.isfile(path) or file_checksum(path) != checksum:
+            return False
+    return True
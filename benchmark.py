@@ -0,0 +1,436 @@
+import argparse
+import glob
+import itertools
+import sys
+import time
+
+from lib import init
+from CA import CA
+from floorfield import *
+from simulation_parameters import SimulationParameters
+from visibility import VisibilityIndex
+from step_kernel import StepKernel, NUMBA_AVAILABLE
+
+
+def place_peds(geometry: Geometry, grid: Grid, num_peds: int, seed: int):
+    """
+    Places num_peds pedestrians at random inside cells.
+    :param geometry: geometry to use
+    :param grid: grid to use
+    :param num_peds: number of pedestrians
+    :param seed: random seed
+    :return: matrix with True for cells containing a pedestrian (see CA.ped_cells)
+    """
+    rng = np.random.default_rng(seed)
+    cells = np.argwhere(grid.inside_cells == 1)
+    chosen = cells[rng.choice(len(cells), num_peds, replace=False)]
+
+    geometry.pedestrians.clear()
+    ped_cells = np.zeros(grid.gridX.shape, dtype=bool)
+    for ped_id, cell in enumerate(chosen):
+        exit_id = list(geometry.exits.keys())[ped_id % len(geometry.exits)]
+        geometry.pedestrians.add([cell[0], cell[1]], Neighbors.left, False, exit_id, ped_id)
+        ped_cells[cell[0], cell[1]] = True
+    return ped_cells
+
+
+def benchmark_parameters(file):
+    """
+    :param file: geometry used for the benchmark
+    :return: simulation parameters used for the benchmarks
+    """
+    simulation_parameters = SimulationParameters()
+    simulation_parameters.max_agents = 0
+    simulation_parameters.init_agents = 0
+    simulation_parameters.standing_agents = 0
+    simulation_parameters.steps = 1
+    simulation_parameters.seed = 124
+    simulation_parameters.file = file
+    return simulation_parameters
+
+
+def benchmark_ped_distance(args):
+    """
+    Compares the individual pedestrian floor fields computed with one FMM per pedestrian against the shared
+    pedestrian distance field.
+    :param args: parsed command line arguments
+    """
+    geometry, grid = init(args.file)
+    simulation_parameters = benchmark_parameters(args.file)
+    inside = grid.inside_cells == 1
+
+    print('{:>6} | {:>12} | {:>12} | {:>12} | {:>12} | {:>10} | {:>10}'.format(
+        'agents', 'ff single/s', 'ff shared/s', 'step single/s', 'step shared/s', 'max diff', 'p99 diff'))
+    for num_peds in args.agents:
+        ped_cells = place_peds(geometry, grid, num_peds, args.seed)
+        peds = list(geometry.pedestrians.values())
+
+        start_time = time.time()
+        single = [compute_individual_ff(geometry, grid, ped, simulation_parameters, ped_cells) for ped in peds]
+        time_single = time.time() - start_time
+
+        start_time = time.time()
+        shared_ped_distance = compute_shared_ped_distance(geometry, grid, ped_cells)
+        shared = [compute_individual_ff(geometry, grid, ped, simulation_parameters, ped_cells, shared_ped_distance)
+                  for ped in peds]
+        time_shared = time.time() - start_time
+
+        diff = np.concatenate([np.abs(a - b)[inside] for a, b in zip(single, shared)])
+
+        step_times = []
+        for shared_ped_field in [False, True]:
+            place_peds(geometry, grid, num_peds, args.seed)
+            simulation_parameters.shared_ped_field = shared_ped_field
+            ca = CA(simulation_parameters, geometry, grid, np.random.default_rng(args.seed))
+            start_time = time.time()
+            ca.compute_step(geometry, grid)
+            step_times.append(time.time() - start_time)
+
+        print('{:6d} | {:12.4f} | {:12.4f} | {:13.4f} | {:13.4f} | {:10.5f} | {:10.5f}'.format(
+            num_peds, time_single, time_shared, step_times[0], step_times[1], diff.max(),
+            np.percentile(diff, 99)))
+
+
+def benchmark_window(args):
+    """
+    Compares the neighbor probabilities of all pedestrians for different window radii against the probabilities
+    considering all visible cells.
+    :param args: parsed command line arguments
+    """
+    geometry, grid = init(args.file, args.cache_path)
+    simulation_parameters = benchmark_parameters(args.file)
+    simulation_parameters.cache_path = args.cache_path
+    place_peds(geometry, grid, args.agents, args.seed)
+    ca = CA(simulation_parameters, geometry, grid, np.random.default_rng(args.seed))
+
+    peds = list(geometry.pedestrians.values())
+    floorfields = [compute_overall_ff(geometry, grid, ca.static_ff[ped.exit_id],
+                                      compute_individual_ff(geometry, grid, ped, simulation_parameters, ca.ped_cells))
+                   for ped in peds]
+
+    def neighbor_probs(window_radius):
+        probs = np.zeros((len(peds), len(Neighbors)))
+        for index, (ped, floorfield) in enumerate(zip(peds, floorfields)):
+            prob = compute_prob_neighbors(geometry, grid, ped, floorfield, False, ca.visibility, ca.sectors,
+                                          ca.point_weight, window_radius)
+            for key, p in prob.items():
+                probs[index, key.value] = p
+        return probs
+
+    exact = neighbor_probs(0)
+
+    print('{:>8} | {:>10} | {:>12} | {:>10} | {:>10}'.format('radius/m', 'tolerance', 'per ped/ms', 'max diff',
+                                                              'mean diff'))
+    for window_radius in args.radius:
+        start_time = time.time()
+        probs = neighbor_probs(window_radius)
+        time_per_ped = (time.time() - start_time) / len(peds) * 1000
+
+        diff = np.abs(probs - exact)
+        print('{:8.1f} | {:10.4f} | {:12.3f} | {:10.5f} | {:10.5f}'.format(
+            window_radius, window_radius_tolerance(window_radius), time_per_ped, diff.max(), diff.mean()))
+
+
+def benchmark_sigmoid(args):
+    """
+    Compares the sigmoid lookup tables against the exact sigmoid on pedestrian distance fields and on infinite and
+    very large distances (e.g., cells unreachable by the graph backend). Exits with status 1 if a table deviates by
+    more than its error.
+    :param args: parsed command line arguments
+    """
+    geometry, grid = init(args.file)
+    ped_cells = place_peds(geometry, grid, args.agents, args.seed)
+    distances = [compute_ped_distance(geometry, grid, ped_cells, ped) for ped in geometry.pedestrians.values()]
+    b, c = args.b, args.c
+
+    start_time = time.time()
+    for _ in range(args.repeat):
+        exact = [distance_to_prob_inc(distance, b, c) for distance in distances]
+    time_exact = (time.time() - start_time) / (args.repeat * len(distances)) * 1e6
+
+    extremes = np.asarray([-np.inf, -1e15, -1e6, 1e6, 1e15, np.inf])
+
+    print('{:>8} | {:>8} | {:>12} | {:>12} | {:>10} | {:>13}'.format('error', 'samples', 'exact/us', 'table/us',
+                                                                     'max diff', 'extremes diff'))
+    mismatches = 0
+    for error in args.error:
+        table = SigmoidTable(b, c, error)
+
+        start_time = time.time()
+        for _ in range(args.repeat):
+            looked_up = [table.prob_inc(distance) for distance in distances]
+        time_table = (time.time() - start_time) / (args.repeat * len(distances)) * 1e6
+
+        diff = max(np.abs(a - b)[grid.field_cells].max() for a, b in zip(exact, looked_up))
+        with np.errstate(over='ignore'):
+            extremes_diff = np.abs(table.prob_inc(extremes.copy()) - distance_to_prob_inc(extremes, b, c)).max()
+        # outside of the sampled range the deviation is the error itself, up to rounding
+        if max(diff, extremes_diff) > error + 1e-12:
+            mismatches += 1
+        print('{:8.0e} | {:8d} | {:12.1f} | {:12.1f} | {:10.6f} | {:13.6f}'.format(
+            error, len(table.table), time_exact, time_table, diff, extremes_diff))
+
+    if mismatches > 0:
+        sys.exit('{} sigmoid tables deviate by more than their error'.format(mismatches))
+
+
+def benchmark_step_workers(args):
+    """
+    Compares the steps computed serially against the steps computed by the step pool, the trajectories have to be
+    identical.
+    :param args: parsed command line arguments
+    """
+    geometry, grid = init(args.file, args.cache_path)
+
+    print('{:>8} | {:>12} | {:>10}'.format('workers', 'step/s', 'identical'))
+    reference = None
+    for step_workers in [1, *args.workers]:
+        simulation_parameters = benchmark_parameters(args.file)
+        simulation_parameters.cache_path = args.cache_path
+        simulation_parameters.shared_ped_field = args.shared_ped_field
+        simulation_parameters.step_workers = step_workers
+
+        place_peds(geometry, grid, args.agents, args.seed)
+        ca = CA(simulation_parameters, geometry, grid, np.random.default_rng(args.seed))
+
+        positions = []
+        start_time = time.time()
+        for _ in range(args.steps):
+            ca.compute_step(geometry, grid)
+            positions.append(geometry.pedestrians.positions().copy())
+        time_per_step = (time.time() - start_time) / args.steps
+        ca.close()
+
+        if reference is None:
+            reference = positions
+        identical = all(np.array_equal(a, b) for a, b in zip(reference, positions))
+        print('{:8d} | {:12.4f} | {:>10}'.format(step_workers, time_per_step, str(identical)))
+
+
+def benchmark_kernel(args):
+    """
+    Compares probabilities and next steps of the compiled kernel against CA.compute_probs and CA.compute_next_steps
+    (shared pedestrian distance) with and without weighting by moving direction and window radius. Exits with status
+    1 if the next steps differ or the probabilities deviate by more than the tolerance.
+    :param args: parsed command line arguments
+    """
+    geometry, grid = init(args.file, args.cache_path)
+    simulation_parameters = benchmark_parameters(args.file)
+    simulation_parameters.cache_path = args.cache_path
+    simulation_parameters.shared_ped_field = True
+
+    print('numba available: {}'.format(NUMBA_AVAILABLE))
+    print('{:>11} | {:>8} | {:>6} | {:>12} | {:>12} | {:>10} | {:>10}'.format(
+        'w_direction', 'radius/m', 'agents', 'numpy/ms', 'kernel/ms', 'max diff', 'same steps'))
+    mismatches = 0
+    for w_direction, window_radius, num_peds in itertools.product([False, True], args.radius, args.agents):
+        simulation_parameters.w_direction = w_direction
+        simulation_parameters.window_radius = window_radius
+
+        place_peds(geometry, grid, num_peds, args.seed)
+        ca = CA(simulation_parameters, geometry, grid, np.random.default_rng(args.seed))
+        kernel = StepKernel(grid, ca.visibility, ca.sectors, ca.point_weight, ca.static_ff)
+
+        # some pedestrians walked before
+        directions = np.random.default_rng(args.seed).integers(len(Neighbors), size=num_peds)
+        for ped, direction in zip(geometry.pedestrians.values(), directions):
+            ped.direction = Neighbors(direction)
+        shared_ped_distance = compute_shared_ped_distance(geometry, grid, ca.ped_cells)
+
+        # the first call compiles the kernel
+        kernel.compute_step(geometry, grid, simulation_parameters, shared_ped_distance, np.random.default_rng(0))
+
+        start_time = time.time()
+        probs = ca.compute_probs(geometry, grid, list(geometry.pedestrians.values()), shared_ped_distance)
+        steps = ca.compute_next_steps(probs, np.random.default_rng(args.seed))
+        time_numpy = (time.time() - start_time) * 1000
+
+        start_time = time.time()
+        kernel_probs, kernel_steps = kernel.compute_step(geometry, grid, simulation_parameters, shared_ped_distance,
+                                                         np.random.default_rng(args.seed))
+        time_kernel = (time.time() - start_time) * 1000
+
+        max_diff = np.abs(probs - kernel_probs).max()
+        same_steps = np.array_equal(steps, kernel_steps)
+        if max_diff > args.tolerance or not same_steps:
+            mismatches += 1
+        print('{:>11} | {:8.1f} | {:6d} | {:12.2f} | {:12.2f} | {:10.2e} | {:>10}'.format(
+            str(w_direction), window_radius, num_peds, time_numpy, time_kernel, max_diff, str(same_steps)))
+
+    if mismatches > 0:
+        sys.exit('{} of the compared configurations differ'.format(mismatches))
+
+
+def benchmark_distance_backends(args):
+    """
+    Compares speed and accuracy of the distance backends against fmm for the static fields and the pedestrian
+    distance of all geometries. Exits with status 1 if a backend puts an entrance cell on the other side of the zero
+    level set than fmm (e.g., makes it a sink) or deviates there by more than the entrance tolerance.
+    :param args: parsed command line arguments
+    """
+    print('{:>24} | {:>8} | {:>7} | {:>10} | {:>10} | {:>10} | {:>10} | {:>15}'.format(
+        'geometry', 'field', 'backend', 'time/ms', 'mean diff/m', 'p99 diff/m', 'max diff/m', 'entrance diff/m'))
+    mismatches = 0
+    for file in args.files:
+        try:
+            geometry, grid = init(file, args.cache_path)
+        except ValueError as e:
+            print('{:>24} | {}'.format(os.path.basename(file), e))
+            continue
+
+        # pedestrian distance to all pedestrians, as used with the shared pedestrian distance
+        num_peds = min(args.agents, int(np.sum(grid.inside_cells == 1)))
+        ped_cells = place_peds(geometry, grid, num_peds, args.seed)
+        fields = {'ped': lambda backend: compute_distance(geometry, grid, grid.get_ped_cells(ped_cells),
+                                                          grid.outside_cells == 1, backend)}
+        for key in get_static_distances(geometry, grid).keys():
+            fields[key] = lambda backend, key=key: compute_static_distance(geometry, grid, key, backend)
+
+        for field, compute in fields.items():
+            reference = compute('fmm')
+            for backend in DISTANCE_BACKENDS.keys():
+                # the first call creates the graph of the graph backend
+                compute(backend)
+                start_time = time.time()
+                for _ in range(args.repeat):
+                    distance = compute(backend)
+                time_per_field = (time.time() - start_time) / args.repeat * 1000
+
+                defined = ~np.logical_or(np.ma.getmaskarray(reference), np.ma.getmaskarray(distance))
+                diff = np.abs(distance.data - reference.data)[defined] / MTOMM
+
+                # pedestrians are spawned at the entrances, hence these cells have to be on the same side of the
+                # zero level set as with fmm
+                entrance = np.logical_and(defined, grid.entrance_cells == 1)
+                entrance_diff = np.abs(distance.data - reference.data)[entrance] / MTOMM
+                same_side = np.array_equal(distance.data[entrance] <= 0, reference.data[entrance] <= 0)
+                max_entrance_diff = entrance_diff.max() if len(entrance_diff) > 0 else 0
+                if not same_side or max_entrance_diff > args.entrance_tolerance:
+                    mismatches += 1
+
+                print('{:>24} | {:>8} | {:>7} | {:10.3f} | {:11.3f} | {:10.3f} | {:10.3f} | {:15.3f}{}'.format(
+                    os.path.basename(file), field, backend, time_per_field, diff.mean(), np.percentile(diff, 99),
+                    diff.max(), max_entrance_diff, '' if same_side else ' sink'))
+
+    if mismatches > 0:
+        sys.exit('{} distance fields differ from fmm at the entrances'.format(mismatches))
+
+
+def benchmark_visibility(args):
+    """
+    Reports build time and memory size of the visibility index for all geometries.
+    :param args: parsed command line arguments
+    """
+    print('{:>30} | {:>8} | {:>12} | {:>10}'.format('geometry', 'cells', 'index/MB', 'time/s'))
+    for file in args.files:
+        try:
+            geometry, grid = init(file)
+        except ValueError as e:
+            print('{:>30} | {}'.format(os.path.basename(file), e))
+            continue
+
+        start_time = time.time()
+        visibility = VisibilityIndex(geometry, grid, args.cache_path)
+        load_time = time.time() - start_time
+
+        print('{:>30} | {:8d} | {:12.2f} | {:10.4f}'.format(os.path.basename(file), len(visibility.cells),
+                                                           visibility.nbytes() / 1024 ** 2, load_time))
+
+
+def benchmark_startup(args):
+    """
+    Reports the time needed to set up geometry and grid for all geometries.
+    :param args: parsed command line arguments
+    """
+    print('{:>30} | {:>12} | {:>12}'.format('geometry', 'geometry/s', 'grid/s'))
+    for file in args.files:
+        start_time = time.time()
+        try:
+            geometry = Geometry(file)
+        except ValueError as e:
+            print('{:>30} | {}'.format(os.path.basename(file), e))
+            continue
+        geometry_time = time.time() - start_time
+
+        start_time = time.time()
+        Grid(geometry)
+        grid_time = time.time() - start_time
+
+        print('{:>30} | {:12.4f} | {:12.4f}'.format(os.path.basename(file), geometry_time, grid_time))
+
+
+def setup_argument_parser():
+    """
+    Set-up argument parser
+    """
+    parser = argparse.ArgumentParser(description='Benchmarks for the dynamic CA waiting model')
+    parser.add_argument('--file', help='geometry used for benchmark', default='./geometries/Bern_geo.xml')
+    parser.add_argument('--seed', help='used random seed (default 124)', type=int, default=124)
+
+    subparsers = parser.add_subparsers(dest='benchmark')
+    subparsers.required = True
+
+    ped_distance = subparsers.add_parser('ped_distance', help='per pedestrian vs shared pedestrian distance field')
+    ped_distance.add_argument('--agents', help='numbers of pedestrians', type=int, nargs='+',
+                              default=[50, 100, 200, 300, 500])
+    ped_distance.set_defaults(func=benchmark_ped_distance)
+
+    window = subparsers.add_parser('window', help='neighbor probabilities for different window radii')
+    window.add_argument('--agents', help='number of pedestrians', type=int, default=200)
+    window.add_argument('--radius', help='window radii in m (0: all visible cells)', type=float, nargs='+',
+                        default=[0, 80, 60, 40, 20, 10])
+    window.add_argument('--cache_path', help='directory of the cache', default='.cache')
+    window.set_defaults(func=benchmark_window)
+
+    sigmoid = subparsers.add_parser('sigmoid', help='sigmoid lookup tables against exact sigmoid')
+    sigmoid.add_argument('--agents', help='number of pedestrian distance fields', type=int, default=50)
+    sigmoid.add_argument('--repeat', help='number of repetitions', type=int, default=20)
+    sigmoid.add_argument('--b', help='sigmoid parameter b', type=float, default=1)
+    sigmoid.add_argument('--c', help='sigmoid parameter c', type=float, default=0.75)
+    sigmoid.add_argument('--error', help='max errors of the tables', type=float, nargs='+', default=[1e-2, 1e-3, 1e-4])
+    sigmoid.set_defaults(func=benchmark_sigmoid)
+
+    step_workers = subparsers.add_parser('step_workers', help='serial steps against steps computed by the step pool')
+    step_workers.add_argument('--agents', help='number of pedestrians', type=int, default=500)
+    step_workers.add_argument('--steps', help='number of steps', type=int, default=5)
+    step_workers.add_argument('--workers', help='numbers of worker processes', type=int, nargs='+', default=[2, 4])
+    step_workers.add_argument('--shared_ped_field', help='use the shared pedestrian distance', action='store_true')
+    step_workers.add_argument('--cache_path', help='directory of the cache', default='.cache')
+    step_workers.set_defaults(func=benchmark_step_workers)
+
+    kernel = subparsers.add_parser('kernel', help='compiled step kernel against NumPy computation')
+    kernel.add_argument('--agents', help='numbers of pedestrians', type=int, nargs='+', default=[100, 300, 500])
+    kernel.add_argument('--radius', help='window radii in m (0: all visible cells)', type=float, nargs='+',
+                        default=[0, 20])
+    kernel.add_argument('--tolerance', help='max deviation of the probabilities', type=float, default=1e-12)
+    kernel.add_argument('--cache_path', help='directory of the cache', default='.cache')
+    kernel.set_defaults(func=benchmark_kernel)
+
+    distance_backends = subparsers.add_parser('distance_backends', help='distance backends against fmm')
+    distance_backends.add_argument('--files', help='geometries to check', nargs='+',
+                                   default=sorted(glob.glob('./geometries/*.xml')))
+    distance_backends.add_argument('--agents', help='number of pedestrians', type=int, default=200)
+    distance_backends.add_argument('--repeat', help='number of repetitions', type=int, default=10)
+    distance_backends.add_argument('--entrance_tolerance', help='max deviation from fmm at the entrance cells in m',
+                                   type=float, default=1)
+    distance_backends.add_argument('--cache_path', help='directory of the cache', default='.cache')
+    distance_backends.set_defaults(func=benchmark_distance_backends)
+
+    visibility = subparsers.add_parser('visibility', help='size of the visibility index (built if not cached)')
+    visibility.add_argument('--files', help='geometries to check', nargs='+',
+                            default=sorted(glob.glob('./geometries/*.xml')))
+    visibility.add_argument('--cache_path', help='directory of the cache', default='.cache')
+    visibility.set_defaults(func=benchmark_visibility)
+
+    startup = subparsers.add_parser('startup', help='set up time of geometry and grid')
+    startup.add_argument('--files', help='geometries to check', nargs='+',
+                         default=sorted(glob.glob('./geometries/*.xml')))
+    startup.set_defaults(func=benchmark_startup)
+
+    return parser
+
+
+if __name__ == '__main__':
+    arg_parser = setup_argument_parser()
+    arguments = arg_parser.parse_args()
+    arguments.func(arguments)
@@ -0,0 +1,85 @@
+import json
+import os
+
+import numpy as np
+
+from CA import CA
+from geometry import Geometry
+from simulation_parameters import SimulationParameters
+from spawner import EntranceSpawner
+from trajectory import Trajectory
+
+CHECKPOINT_FILENAME = 'checkpoint.npz'
+"""File in the output directory the latest checkpoint is written to."""
+
+
+def checkpoint_filename(output_path):
+    """
+    :param output_path: output directory of the simulation
+    :return: file name of the checkpoint of the simulation
+    """
+    return os.path.join(output_path, CHECKPOINT_FILENAME)
+
+
+def save_checkpoint(filename, step: int, simulation_parameters: SimulationParameters, geometry: Geometry, ca: CA,
+                    traj: Trajectory, spawner: EntranceSpawner):
+    """
+    Writes the state of the simulation before *step* (uncompressed npz), the file is replaced atomically. The
+    occupancy and static floor fields are not written, they are derived from pedestrians and parameters.
+    :param filename: file of the checkpoint
+    :param step: next step to compute
+    :param simulation_parameters: parameters of simulation
+    :param geometry: geometry to use
+    :param ca: CA of the simulation
+    :param traj: trajectory of the simulation
+    :param spawner: spawner of the simulation
+    """
+    arrays = {'step': np.asarray(step),
+              'parameter_hash': np.asarray(simulation_parameters.hash()),
+              'rng_state': np.asarray(json.dumps(ca.rng.bit_generator.state)),
+              'peds_next_id': np.asarray(geometry.pedestrians.next_id)}
+    for prefix, state in [('peds', geometry.pedestrians.state()), ('traj', traj.state()), ('spawner', spawner.state())]:
+        for key, values in state.items():
+            arrays['{}_{}'.format(prefix, key)] = values
+
+    tmp_filename = '{}.tmp'.format(filename)
+    with open(tmp_filename, 'wb') as file:
+        np.savez(file, **arrays)
+    os.replace(tmp_filename, filename)
+
+
+def load_checkpoint(filename, simulation_parameters: SimulationParameters):
+    """
+    Reads a checkpoint written with the same simulation parameters.
+    :param filename: file of the checkpoint
+    :param simulation_parameters: parameters of simulation
+    :return: next step to compute, random number generator state and states of pedestrians, trajectory and spawner
+    """
+    with np.load(filename) as data:
+        arrays = {name: data[name] for name in data.files}
+
+    if str(arrays['parameter_hash']) != simulation_parameters.hash():
+        raise ValueError('Checkpoint {} was written with different simulation parameters'.format(filename))
+
+    states = {'peds': {}, 'traj': {}, 'spawner': {}}
+    for name, values in arrays.items():
+        prefix, _, key = name.partition('_')
+        if prefix in states:
+            states[prefix][key] = values
+    states['peds'].pop('next_id')
+
+    return (int(arrays['step']), json.loads(str(arrays['rng_state'])), int(arrays['peds_next_id']), states['peds'],
+            states['traj'], states['spawner'])
+
+
+def is_resumable(filename, simulation_parameters: SimulationParameters):
+    """
+    :param filename: file of the checkpoint
+    :param simulation_parameters: parameters of simulation
+    :return: the checkpoint exists and was written with the same simulation parameters
+    """
+    try:
+        with np.load(filename) as data:
+            return str(data['parameter_hash']) == simulation_parameters.hash()
+    except (OSError, ValueError, KeyError):
+        return False
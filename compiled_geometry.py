@@ -0,0 +1,76 @@
+import os
+
+import numpy as np
+
+from constants import *
+from distanceCalculator import compute_static_distances
+from geometry import Geometry
+from grid import Grid
+
+COMPILED_GEOMETRY_VERSION = 1
+"""Version of the compiled geometry format, increase if layers or distance fields are computed differently."""
+
+
+def compiled_geometry_filename(geometry: Geometry, cache_path: str):
+    """
+    :param geometry: geometry to use
+    :param cache_path: directory of the cache
+    :return: file name of the compiled geometry, depends on xml content, cell size and format version
+    """
+    return os.path.join(cache_path, 'geometry_{}_{:d}_v{:d}.npz'.format(geometry.hash, int(CELLSIZE),
+                                                                        COMPILED_GEOMETRY_VERSION))
+
+
+def compile_geometry(geometry: Geometry, cache_path: str):
+    """
+    Computes the grid layers and static distance fields of the geometry and stores them in the cache.
+    :param geometry: geometry to use
+    :param cache_path: directory of the cache
+    :return: grid of the geometry
+    """
+    grid = Grid(geometry)
+    grid.static_distances = compute_static_distances(geometry, grid)
+
+    arrays = {}
+    for key, layer in grid.layers().items():
+        arrays['layer_{}'.format(key)] = layer.astype(np.int8)
+    for key, distance in grid.static_distances.items():
+        arrays['distance_{}'.format(key)] = distance.data
+        arrays['mask_{}'.format(key)] = np.ma.getmaskarray(distance)
+
+    filename = compiled_geometry_filename(geometry, cache_path)
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+
+    # write to temporary file first, so concurrent simulations never read incomplete files
+    tmp_filename = '{}.{}.tmp.npz'.format(filename[:-len('.npz')], os.getpid())
+    np.savez_compressed(tmp_filename, **arrays)
+    os.replace(tmp_filename, filename)
+
+    return grid
+
+
+def load_compiled_geometry(geometry: Geometry, cache_path: str):
+    """
+    Loads the grid layers and static distance fields of the geometry from the cache, if they are not cached yet they
+    are computed.
+    :param geometry: geometry to use
+    :param cache_path: directory of the cache
+    :return: grid of the geometry
+    """
+    filename = compiled_geometry_filename(geometry, cache_path)
+    if not os.path.isfile(filename):
+        return compile_geometry(geometry, cache_path)
+
+    layers = {}
+    static_distances = {}
+    with np.load(filename) as data:
+        for name in data.files:
+            if name.startswith('layer_'):
+                layers[name[len('layer_'):]] = data[name].astype(float)
+            elif name.startswith('distance_'):
+                key = name[len('distance_'):]
+                static_distances[key] = np.ma.MaskedArray(data[name], data['mask_{}'.format(key)])
+
+    grid = Grid(geometry, layers)
+    grid.static_distances = static_distances
+    return grid
@@ -9,6 +9,18 @@ CELLSIZE = 0.5 * MTOMM
 THRESHOLD = 0.5 * CELLSIZE
 """Threshold for checking if a cell belongs to some structure."""
 
+BOUNDARY_EPSILON = 1e-6
+"""Tolerance for checking if a point lies on a boundary."""
+
+PED_DISTANCE_OFFSET = 0.5 * CELLSIZE
+"""Offset between the euclidean and FMM distance to a pedestrian, used for the shared pedestrian distance."""
+
+POINT_WEIGHT_B = 40
+"""Sigmoid parameter b (in m) of the distance weight of the floor field seen by a pedestrian."""
+
+POINT_WEIGHT_C = 0.15
+"""Sigmoid parameter c of the distance weight of the floor field seen by a pedestrian."""
+
 
 class Neighbors(Enum):
     """
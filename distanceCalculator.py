@@ -1,4 +1,11 @@
+from dataclasses import dataclass
+import hashlib
+
 import skfmm
+from scipy import ndimage
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from scipy.spatial import cKDTree
 
 from IO import *
 from geometry import Geometry
@@ -30,30 +37,139 @@ def compute_distance_fmm(geometry: Geometry, grid: Grid, start, mask, speed=None
     return distance
 
 
-def compute_entrance_distance(geometry: Geometry, grid: Grid):
+def zero_level_cells(grid: Grid, start, mask):
+    """
+    :param grid: Grid to use
+    :param start: start cells
+    :param mask: masked cells
+    :return: matrix with True for the not masked cells on or inside the zero level set of compute_distance_fmm
+             (start cells and cells which are not inside, entrance cells are inside)
+    """
+    return np.logical_and(~mask, grid.inside_cells - 5 * start <= 0)
+
+
+def compute_distance_edt(geometry: Geometry, grid: Grid, start, mask):
+    """
+    Compute the straight line distance to start, obstacles are ignored. The distance between cell centers is shifted
+    by PED_DISTANCE_OFFSET to match the zero level set of compute_distance_fmm (see compute_ped_distance_shared).
+    :param geometry: Geometry to use
+    :param grid: Grid to use
+    :param start: start cells
+    :param mask: masked cells
+    :return: distance to start by euclidean distance transform
+    """
+    sources = zero_level_cells(grid, start, mask)
+    distance = ndimage.distance_transform_edt(~sources) * grid.cellsize - PED_DISTANCE_OFFSET
+
+    return np.ma.MaskedArray(distance, mask)
+
+
+distance_graphs = {}
+"""Graphs of the not masked cells of all used masks, shared by all distance fields."""
+
+
+def get_distance_graph(grid: Grid, mask):
+    """
+    Graph of the not masked cells, each cell is connected to its 8 neighbors with the distance of the cell centers.
+    Diagonal neighbors are only connected if both cells in between are not masked, hence paths do not cut corners.
+    :param grid: Grid to use
+    :param mask: masked cells
+    :return: sparse adjacency matrix indexed by flat index of the cells, created on first use
+    """
+    key = (grid.dimX, grid.dimY, grid.cellsize, hashlib.sha1(np.packbits(mask).tobytes()).hexdigest())
+    if key in distance_graphs:
+        return distance_graphs[key]
+
+    free = ~mask
+    index = np.arange(grid.dimX * grid.dimY).reshape(grid.dimX, grid.dimY)
+    rows, cols, weights = [], [], []
+    for di, dj in [(1, 0), (0, 1), (1, 1), (1, -1)]:
+        # cells (i, j) and (i + di, j + dj)
+        source = (slice(0, grid.dimX - di), slice(max(-dj, 0), grid.dimY - max(dj, 0)))
+        target = (slice(di, grid.dimX), slice(max(dj, 0), grid.dimY + min(dj, 0)))
+        connected = np.logical_and(free[source], free[target])
+        if di != 0 and dj != 0:
+            connected &= free[target[0], source[1]]
+            connected &= free[source[0], target[1]]
+
+        rows.append(index[source][connected])
+        cols.append(index[target][connected])
+        weights.append(np.full(connected.sum(), grid.cellsize * np.hypot(di, dj)))
+
+    graph = csr_matrix((np.concatenate(weights), (np.concatenate(rows), np.concatenate(cols))),
+                       shape=(grid.dimX * grid.dimY, grid.dimX * grid.dimY))
+    distance_graphs[key] = graph
+    return graph
+
+
+def compute_distance_graph(geometry: Geometry, grid: Grid, start, mask):
+    """
+    Compute the distance to start along the shortest paths in the graph of the not masked cells (multi source
+    Dijkstra). The distance is shifted by PED_DISTANCE_OFFSET like in compute_distance_edt, cells not connected to
+    start are masked.
+    :param geometry: Geometry to use
+    :param grid: Grid to use
+    :param start: start cells
+    :param mask: masked cells
+    :return: distance to start by shortest paths
+    """
+    graph = get_distance_graph(grid, mask)
+    sources = np.flatnonzero(zero_level_cells(grid, start, mask))
+
+    distance = dijkstra(graph, directed=False, indices=sources, min_only=True).reshape(grid.gridX.shape)
+    distance = distance - PED_DISTANCE_OFFSET
+
+    return np.ma.MaskedArray(distance, np.logical_or(mask, ~np.isfinite(distance)))
+
+
+DISTANCE_BACKENDS = {'fmm': compute_distance_fmm,
+                     'edt': compute_distance_edt,
+                     'graph': compute_distance_graph}
+"""Methods computing the distance to start cells."""
+
+
+def compute_distance(geometry: Geometry, grid: Grid, start, mask, backend: str = 'fmm'):
+    """
+    Compute the distance to start in geometry with the given backend.
+    :param geometry: Geometry to use
+    :param grid: Grid to use
+    :param start: start cells
+    :param mask: masked cells
+    :param backend: 'fmm' (fast marching, around obstacles), 'edt' (straight line, ignores obstacles) or 'graph'
+                    (shortest paths between cell centers, around obstacles)
+    :return: distance to start
+    """
+    if backend not in DISTANCE_BACKENDS:
+        raise ValueError('Unknown distance backend {}, use one of {}'.format(backend, list(DISTANCE_BACKENDS)))
+    return DISTANCE_BACKENDS[backend](geometry, grid, start, mask)
+
+
+def compute_entrance_distance(geometry: Geometry, grid: Grid, backend: str = 'fmm'):
     """
     Compute the distance to the entrances.
     :param geometry: Geometry to use
     :param grid: Grid to use
+    :param backend: distance backend (see compute_distance)
     :return: Distance field to entrance
     """
     entrances = grid.entrance_cells
     outside = grid.outside_cells
     mask = np.logical_and(outside == 1, entrances != 1)
 
-    return compute_distance_fmm(geometry, grid, entrances, mask)
+    return compute_distance(geometry, grid, entrances, mask, backend)
 
 
-def compute_exit_distance(geometry: Geometry, grid: Grid, exit_id: int):
+def compute_exit_distance(geometry: Geometry, grid: Grid, exit_id: int, backend: str = 'fmm'):
     """
     Compute the distance to the exit with exit_id.
     :param geometry: Geometry to use
     :param grid: Grid to use
     :param exit_id: Exit id
+    :param backend: distance backend (see compute_distance)
     :return: Distance field to specific exit
     """
 
-    exits = grid.exit_cells[exit_id]
+    exits = grid.exit_cells[exit_id].copy()
     wall = grid.get_wall_cells(geometry)
 
     exits[wall == 1] = 0
@@ -62,14 +178,16 @@ def compute_exit_distance(geometry: Geometry, grid: Grid, exit_id: int):
     mask = np.logical_and(outside == 1, exits != 1)
 
     mask_inside = grid.inside_cells == 0
-    return np.ma.MaskedArray(compute_distance_fmm(geometry, grid, exits, mask), mask_inside)
+    distance = compute_distance(geometry, grid, exits, mask, backend)
+    return np.ma.MaskedArray(distance, np.logical_or(mask_inside, np.ma.getmaskarray(distance)))
 
 
-def compute_wall_distance(geometry: Geometry, grid: Grid):
+def compute_wall_distance(geometry: Geometry, grid: Grid, backend: str = 'fmm'):
     """
     Compute the distance to the walls.
     :param geometry: Geometry to use
     :param grid: Grid to use
+    :param backend: distance backend (see compute_distance)
     :return: Distance field to walls
     """
 
@@ -82,42 +200,128 @@ def compute_wall_distance(geometry: Geometry, grid: Grid):
     outside = grid.outside_cells
     mask = np.logical_and(outside == 1, wall != 1)
 
-    distance = compute_distance_fmm(geometry, grid, wall, mask)
-    return np.ma.MaskedArray(distance, outside == 1)
+    distance = compute_distance(geometry, grid, wall, mask, backend)
+    return np.ma.MaskedArray(distance, np.logical_or(outside == 1, np.ma.getmaskarray(distance)))
+
+
+def compute_static_distance(geometry: Geometry, grid: Grid, key: str, backend: str = 'fmm'):
+    """
+    Compute one distance field which only depends on the geometry.
+    :param geometry: Geometry to use
+    :param grid: Grid to use
+    :param key: 'entrance', 'wall' or 'exit_<id>'
+    :param backend: distance backend (see compute_distance)
+    :return: Distance field
+    """
+    if key == 'entrance':
+        return compute_entrance_distance(geometry, grid, backend)
+    if key == 'wall':
+        return compute_wall_distance(geometry, grid, backend)
+    return compute_exit_distance(geometry, grid, int(key[len('exit_'):]), backend)
+
+
+def static_distance_type(key: str):
+    """
+    :param key: key of the static distance field ('entrance', 'wall' or 'exit_<id>')
+    :return: type of the field ('entrance', 'wall' or 'exit')
+    """
+    return 'exit' if key.startswith('exit_') else key
+
+
+def compute_static_distances(geometry: Geometry, grid: Grid, backends=None):
+    """
+    Compute all distance fields which only depend on the geometry.
+    :param geometry: Geometry to use
+    :param grid: Grid to use
+    :param backends: distance backend of each field type ('entrance', 'wall', 'exit'), fmm if None or not given
+    :return: Distance fields to entrances ('entrance'), walls ('wall') and each exit ('exit_<id>')
+    """
+    if backends is None:
+        backends = {}
+
+    keys = ['entrance', 'wall'] + ['exit_{}'.format(exit_id) for exit_id in geometry.exits.keys()]
+    return {key: compute_static_distance(geometry, grid, key, backends.get(static_distance_type(key), 'fmm'))
+            for key in keys}
 
 
-def compute_ped_distance(geometry: Geometry, grid: Grid, ped: Pedestrian = None):
+def compute_ped_distance(geometry: Geometry, grid: Grid, ped_cells, ped: Pedestrian = None, backend: str = 'fmm'):
     """
     Compute the distance to the pedestrians excluding ped.
     :param geometry: Geometry to use
     :param grid: Grid to use
+    :param ped_cells: True for cells containing a pedestrian
     :param ped: Pedestrian to ignorte
-    :return: Distance field to entrance
+    :param backend: distance backend (see compute_distance)
+    :return: Distance field to pedestrians, undefined outside of grid.field_cells
     """
 
-    peds = grid.get_ped_cells(geometry, ped)
+    peds = grid.get_ped_cells(ped_cells, ped)
     outside = grid.outside_cells
     mask = outside == 1
 
-    return compute_distance_fmm(geometry, grid, peds, mask)
+    return compute_distance(geometry, grid, peds, mask, backend).data
 
 
-def compute_point_distance(geometry: Geometry, grid: Grid, cell: [int, int]):
+@dataclass
+class SharedPedDistance:
     """
-    Comp
-    :param geometry:
-    :param grid:
-    :param cell:
-    :return:
+    Pedestrian distance information computed once per step and shared by all pedestrians.
     """
-    entrances = grid.entrance_cells
+    distance: np.ndarray
+    """FMM distance to the closest pedestrian, undefined outside of grid.field_cells."""
+
+    nearest_id: np.ndarray
+    """Id of the (euclidean) closest pedestrian for each cell."""
+
+    second_distance: np.ndarray
+    """Euclidean distance to the second closest pedestrian for each cell."""
+
+
+def compute_shared_ped_distance(geometry: Geometry, grid: Grid, ped_cells, backend: str = 'fmm'):
+    """
+    Compute the distance information to all pedestrians at once, each individual distance field can then be derived
+    by compute_ped_distance_shared.
+    :param geometry: Geometry to use
+    :param grid: Grid to use
+    :param ped_cells: True for cells containing a pedestrian
+    :param backend: distance backend of the distance to the closest pedestrian (see compute_distance)
+    :return: Shared distance information of all pedestrians
+    """
+    peds = grid.get_ped_cells(ped_cells)
     outside = grid.outside_cells
-    mask = np.logical_and(outside == 1, entrances != 1)
+    mask = outside == 1
 
-    x0 = grid.gridX[cell[0]][cell[1]]
-    y0 = grid.gridY[cell[0]][cell[1]]
+    distance = compute_distance(geometry, grid, peds, mask, backend).data
 
-    distance = np.sqrt((grid.gridX - x0) ** 2 + (grid.gridY - y0) ** 2)
+    ids = geometry.pedestrians.get_ids()
+    pos = geometry.pedestrians.positions()
+    ped_points = np.column_stack((grid.gridX[pos[:, 0], pos[:, 1]], grid.gridY[pos[:, 0], pos[:, 1]]))
+    cell_points = np.column_stack((grid.gridX.ravel(), grid.gridY.ravel()))
 
-    distance = np.ma.MaskedArray(distance, mask)
-    return distance
+    # second column is inf (and index out of range) if only one pedestrian exists
+    nearest_distance, nearest_index = cKDTree(ped_points).query(cell_points, k=2)
+    nearest_id = ids[np.minimum(nearest_index[:, 0], len(ids) - 1)].reshape(grid.gridX.shape)
+    second_distance = nearest_distance[:, 1].reshape(grid.gridX.shape)
+
+    return SharedPedDistance(distance, nearest_id, second_distance)
+
+
+def compute_ped_distance_shared(grid: Grid, shared: SharedPedDistance, ped: Pedestrian, window=None):
+    """
+    Compute the distance to the pedestrians excluding ped from the shared distance information.
+
+    Outside the cells closest to ped the FMM distance to all pedestrians is used, which is the same as in
+    compute_ped_distance. Inside, the euclidean distance to the second closest pedestrian is used, shifted by
+    PED_DISTANCE_OFFSET to match the FMM initialization around the start cells. The resulting field deviates from
+    compute_ped_distance only near obstacles and at the boundary of the cells closest to ped.
+    :param grid: Grid to use
+    :param shared: Shared pedestrian distance information of current step
+    :param ped: Pedestrian to ignore
+    :param window: slices of the grid the distance is computed for, if None the whole grid is used
+    :return: Distance field to pedestrians in window, undefined outside of grid.field_cells
+    """
+    if window is None:
+        window = (slice(None), slice(None))
+
+    own_cells = shared.nearest_id[window] == ped.id
+    return np.where(own_cells, shared.second_distance[window] - PED_DISTANCE_OFFSET, shared.distance[window])
@@ -10,9 +10,10 @@ from geometry import Geometry
 from grid import Grid
 from pedestrian import Pedestrian
 from constants import *
-from scipy.spatial import Voronoi, voronoi_plot_2d
 
 from plotting import plot_prob_field
+from visibility import VisibilityIndex
+from sectors import SectorTemplates
 from shapely.geometry import Polygon, Point
 from descartes.patch import PolygonPatch
 
@@ -32,31 +33,175 @@ def distance_to_prob_dec(distance_field, b, c):
     return 1 - distance_to_prob_inc(distance_field, b, c)
 
 
+class SigmoidTable:
+    """
+    Lookup table of distance_to_prob_inc for fixed parameters b and c. The sigmoid is sampled with a resolution (in
+    mm) such that the closest sample differs by at most error from the exact value, its slope is at most c/4 per m.
+    Distances outside of the sampled range are clipped, there the sigmoid is within error of 0 or 1.
+    """
+
+    def __init__(self, b, c, error, resolution=None):
+        """
+        Samples the sigmoid.
+        :param b: sigmoid parameter b (in m)
+        :param c: sigmoid parameter c
+        :param error: max absolute error of the looked up values, in (0, 0.5)
+        :param resolution: distance between samples (in mm), if None it is derived from error
+        """
+        # from 0.5 on the sampled range is empty and every distance is looked up as about error
+        if not 0 < error < 0.5:
+            raise ValueError('Sigmoid table error has to be in (0, 0.5), got {}'.format(error))
+
+        if resolution is None:
+            resolution = 8 * MTOMM * error / c
+
+        half_width = np.log(1 / error - 1) / c * MTOMM
+        self.start = b * MTOMM - half_width
+        self.resolution = resolution
+
+        size = int(np.ceil(2 * half_width / resolution)) + 1
+        self.table = distance_to_prob_inc(self.start + resolution * np.arange(size), b, c)
+
+        # index of the closest sample is int(distance * scale + offset)
+        self.scale = 1 / resolution
+        self.offset = 0.5 - self.start / resolution
+
+    def prob_inc(self, distance_field):
+        """
+        :param distance_field: distances (in mm)
+        :return: looked up distance_to_prob_inc of the distances
+        """
+        index = distance_field * self.scale
+        index += self.offset
+
+        # clip before the cast, infinite distances (e.g., cells unreachable by the graph backend) would overflow
+        np.clip(index, 0, len(self.table) - 1, out=index)
+        return np.take(self.table, index.astype(np.intp))
+
+    def prob_dec(self, distance_field):
+        """
+        :param distance_field: distances (in mm)
+        :return: looked up distance_to_prob_dec of the distances
+        """
+        return 1 - self.prob_inc(distance_field)
+
+
+sigmoid_tables = {}
+"""Sigmoid tables of all used parameters, shared by all pedestrians and steps."""
+
+
+def get_sigmoid_table(b, c, error):
+    """
+    :param b: sigmoid parameter b (in m)
+    :param c: sigmoid parameter c
+    :param error: max absolute error of the looked up values
+    :return: sigmoid table of the parameters, created on first use
+    """
+    key = (b, c, error)
+    if key not in sigmoid_tables:
+        sigmoid_tables[key] = SigmoidTable(b, c, error)
+    return sigmoid_tables[key]
+
+
+class PointWeightKernel:
+    """
+    Distance weight of the floor field seen by a pedestrian, decreasing with the distance to the pedestrian. On a
+    regular grid the weight only depends on the cell offset, hence it is precomputed once for all offsets and sliced
+    at the cell of the pedestrian.
+    """
+
+    def __init__(self, grid: Grid):
+        """
+        Computes the weight for all cell offsets.
+        :param grid: grid to use
+        """
+        self.dimX = grid.dimX
+        self.dimY = grid.dimY
+
+        di, dj = np.meshgrid(np.arange(-(self.dimX - 1), self.dimX), np.arange(-(self.dimY - 1), self.dimY),
+                             indexing='ij')
+        distance = grid.cellsize * np.sqrt(di ** 2 + dj ** 2)
+        self.kernel = distance_to_prob_dec(distance, POINT_WEIGHT_B, POINT_WEIGHT_C)
+
+    def weights(self, i: int, j: int, window=None):
+        """
+        :param i: 1st dimension index of cell
+        :param j: 2nd dimension index of cell
+        :param window: slices of the grid, if None the whole grid is used
+        :return: weight of the cells in window for a pedestrian in cell (i, j), view into the kernel
+        """
+        if window is None:
+            window = (slice(0, self.dimX), slice(0, self.dimY))
+
+        offset_i = self.dimX - 1 - i
+        offset_j = self.dimY - 1 - j
+        return self.kernel[offset_i + window[0].start:offset_i + window[0].stop,
+                           offset_j + window[1].start:offset_j + window[1].stop]
+
+
+def get_static_distances(geometry: Geometry, grid: Grid, simulation_parameters: SimulationParameters = None):
+    """
+    The distance fields of the static floor field only depend on the geometry, hence they are computed once per grid
+    (or loaded with the compiled geometry) and reused for every parameter set. Fields of types using another backend
+    than fmm are computed on first use and kept on the grid as well.
+    :param geometry: Geometry to use
+    :param grid: Grid to use
+    :param simulation_parameters: parameters of simulation (distance backends), if None fmm is used for all fields
+    :return: static distance fields (see compute_static_distances)
+    """
+    if grid.static_distances is None:
+        grid.static_distances = compute_static_distances(geometry, grid)
+    if simulation_parameters is None:
+        return grid.static_distances
+
+    backends = simulation_parameters.static_distance_backends()
+    distances = {}
+    for key, distance in grid.static_distances.items():
+        backend = backends[static_distance_type(key)]
+        if backend == 'fmm':
+            distances[key] = distance
+        else:
+            cached = grid.backend_static_distances.setdefault(backend, {})
+            if key not in cached:
+                cached[key] = compute_static_distance(geometry, grid, key, backend)
+            distances[key] = cached[key]
+    return distances
+
+
 def compute_static_ff(geometry: Geometry, grid: Grid, simulation_parameters: SimulationParameters):
     static = {}
 
+    # only the transformation of the distances depends on the simulation parameters
+    static_distances = get_static_distances(geometry, grid, simulation_parameters)
+
     # compute door probability: further is better
-    door_distance = compute_entrance_distance(geometry, grid)
-    door_prob = distance_to_prob_inc(door_distance, simulation_parameters.door_b, simulation_parameters.door_c)
+    door_distance = static_distances['entrance']
+    door_prob = distance_to_prob_inc(door_distance.data, simulation_parameters.door_b, simulation_parameters.door_c)
 
     # compute wall probability: closer is better
-    wall_distance = compute_wall_distance(geometry, grid)
-    wall_prob = distance_to_prob_dec(wall_distance, simulation_parameters.wall_b, simulation_parameters.wall_c)
+    wall_distance = static_distances['wall']
+    wall_prob = distance_to_prob_dec(wall_distance.data, simulation_parameters.wall_b, simulation_parameters.wall_c)
 
     for exit_id in geometry.exits.keys():
         # compute distance to exits: closer is better
-        exit_distance = compute_exit_distance(geometry, grid, exit_id)
-        exit_prob = distance_to_prob_dec(exit_distance, simulation_parameters.exit_b, simulation_parameters.exit_c)
+        exit_distance = static_distances['exit_{}'.format(exit_id)]
+        exit_prob = distance_to_prob_dec(exit_distance.data, simulation_parameters.exit_b,
+                                         simulation_parameters.exit_c)
+
+        # cells without distance information have no floor field
+        undefined = np.logical_or(np.ma.getmaskarray(wall_distance), np.ma.getmaskarray(exit_distance))
 
         if simulation_parameters.w_door == 0:
             door_filter = np.ones_like(grid.gridX)
         else:
             door_filter = simulation_parameters.w_door * door_prob
+            undefined = np.logical_or(undefined, np.ma.getmaskarray(door_distance))
 
         # sum everything up for static FF
         ff = door_filter \
              * (simulation_parameters.w_wall * wall_prob
                 + simulation_parameters.w_exit * exit_prob)
+        ff[undefined] = 0
 
         if simulation_parameters.plot:
             plot_prob_field(geometry, grid, door_filter, "door")
@@ -69,18 +214,68 @@ def compute_static_ff(geometry: Geometry, grid: Grid, simulation_parameters: Sim
     return static
 
 
-def compute_individual_ff(geometry: Geometry, grid: Grid, ped: Pedestrian, simulation_parameters: SimulationParameters):
-    if len(geometry.pedestrians.values()) > 1:
-        ped_distance = compute_ped_distance(geometry, grid, ped)
+def ped_distance_to_prob(grid: Grid, ped_distance, simulation_parameters: SimulationParameters, window=None):
+    """
+    :param grid: grid to use
+    :param ped_distance: distance field to pedestrians in window
+    :param simulation_parameters: parameters of simulation (ped_b, ped_c and sigmoid_error)
+    :param window: slices of the grid covered by ped_distance, if None the whole grid is used
+    :return: pedestrian probability in window, 0 outside of grid.field_cells
+    """
+    if window is None:
+        window = (slice(None), slice(None))
+
+    if simulation_parameters.sigmoid_error > 0:
+        ped_prob = get_sigmoid_table(simulation_parameters.ped_b, simulation_parameters.ped_c,
+                                     simulation_parameters.sigmoid_error).prob_inc(ped_distance)
+    else:
         ped_prob = distance_to_prob_inc(ped_distance, simulation_parameters.ped_b, simulation_parameters.ped_c)
+    ped_prob[~grid.field_cells[window]] = 0
+    return ped_prob
+
+
+def compute_individual_ff(geometry: Geometry, grid: Grid, ped: Pedestrian, simulation_parameters: SimulationParameters,
+                          ped_cells, shared_ped_distance: SharedPedDistance = None, window=None):
+    """
+    :param geometry: geometry to use
+    :param grid: grid to use
+    :param ped: pedestrian the floor field is computed for
+    :param simulation_parameters: parameters of simulation
+    :param ped_cells: True for cells containing a pedestrian
+    :param shared_ped_distance: pedestrian distance information of the current step, if None the distance is
+                                computed for ped (FMM on the whole grid)
+    :param window: slices of the grid the floor field is computed for, if None the whole grid is used
+    :return: individual floor field of ped in window
+    """
+    if window is None:
+        window = (slice(None), slice(None))
+
+    if len(geometry.pedestrians) > 1:
+        if shared_ped_distance is None:
+            ped_distance = compute_ped_distance(geometry, grid, ped_cells, ped,
+                                                simulation_parameters.ped_distance_backend)[window]
+        else:
+            ped_distance = compute_ped_distance_shared(grid, shared_ped_distance, ped, window)
+        ped_prob = ped_distance_to_prob(grid, ped_distance, simulation_parameters, window)
     else:
-        ped_prob = np.ones_like(grid.gridX)
+        ped_prob = np.ones_like(grid.gridX[window])
 
     return ped_prob
 
 
-def compute_overall_ff(geometry: Geometry, grid: Grid, static_ff, individual_ff):
-    combined = static_ff * individual_ff
+def compute_overall_ff(geometry: Geometry, grid: Grid, static_ff, individual_ff, window=None):
+    """
+    :param geometry: geometry to use
+    :param grid: grid to use
+    :param static_ff: static floor field of the exit of the pedestrian
+    :param individual_ff: individual floor field of the pedestrian in window
+    :param window: slices of the grid covered by individual_ff, if None the whole grid is used
+    :return: combined floor field in window
+    """
+    if window is None:
+        window = (slice(None), slice(None))
+
+    combined = static_ff[window] * individual_ff
 
     return combined
 
@@ -89,63 +284,64 @@ def init_dynamic_ff():
     return
 
 
-def compute_prob_neighbors(geometry: Geometry, grid: Grid, ped: Pedestrian, floorfield, weight_direction: bool):
+def window_radius_tolerance(window_radius: float):
+    """
+    Cells farther than the window radius are ignored in compute_prob_neighbors, the distance weight of these cells
+    is at most the returned tolerance (e.g., 0.047 for 60m, 0.0025 for 80m).
+    :param window_radius: window radius in m, 0 for no limit
+    :return: max distance weight of ignored cells
+    """
+    if window_radius <= 0:
+        return 0
+    return distance_to_prob_dec(window_radius * MTOMM, POINT_WEIGHT_B, POINT_WEIGHT_C)
+
+
+def compute_prob_neighbors(geometry: Geometry, grid: Grid, ped: Pedestrian, floorfield, weight_direction: bool,
+                           visibility: VisibilityIndex, sectors: SectorTemplates, point_weight: PointWeightKernel,
+                           window_radius: float = 0, visible_window=None):
+    """
+    :param geometry: geometry to use
+    :param grid: grid to use
+    :param ped: pedestrian the probabilities are computed for
+    :param floorfield: combined floor field of ped in the window of visible_window, whole grid if visible_window is
+                       None
+    :param weight_direction: weight neighbors by moving direction
+    :param visibility: cell to cell visibility index
+    :param sectors: Voronoi sector templates of the neighbors
+    :param point_weight: distance weight of the floor field seen by a pedestrian
+    :param window_radius: only cells within this radius (in m) are considered, 0 for no limit
+    :param visible_window: window and visible cells of ped (see VisibilityIndex.visible_window), computed if None
+    :return: probabilities of the available neighbors
+    """
     prob = {}
 
-    # compute visible area
-    x, y = grid.get_coordinates(ped.i(), ped.j())
-    vis = geometry.visible_area(x, y)
-
-    # compute voronoi polygons of neighbors
-    neighbor_voronoi_polygons = compute_voronoi_neighbors(geometry, grid, ped)
-
-    intersections = []
-
-    weight_distance = compute_point_distance(geometry, grid, [ped.i(), ped.j()])
-    weight_prob = distance_to_prob_dec(weight_distance, 40, 0.15)
+    # only cells visible from the pedestrian count, hence everything is evaluated in the bounding box of the visible
+    # cells (within window_radius in m, see window_radius_tolerance)
+    if visible_window is None:
+        window, visible = visibility.visible_window(ped.i(), ped.j(), window_radius * MTOMM / grid.cellsize)
+        floorfield = floorfield[window]
+    else:
+        window, visible = visible_window
 
-    weighted_floorfield = weight_prob * floorfield
+    # compute voronoi sectors of neighbors
+    adjacency = grid.adjacency[grid.flat_index(ped.i(), ped.j())]
+    neighbors = [key for key in Neighbors if adjacency[key.value] != -1]
+    neighbor_sectors = sectors.sector_cells(ped.i(), ped.j(), neighbors)
 
-    inside = grid.get_inside_polygon_cells(geometry, vis.exterior.coords)
+    weighted_floorfield = point_weight.weights(ped.i(), ped.j(), window) * floorfield
 
-    # sum up every cell in neighbor polygon to neighbor cell
-    # sum is weighted by distance, closer = more important
-    for key, polygon in neighbor_voronoi_polygons.items():
+    # max of every visible cell in neighbor sector to neighbor cell
+    # weighted by distance, closer = more important
+    for key in neighbors:
         if key == Neighbors.self:
-            intersections.append(polygon)
-            prob[key] = floorfield.filled(0)[ped.i()][ped.j()]
-
-        elif polygon is not None:
-            p = Polygon(polygon.coords)
-            inter = p.intersection(vis)
-
-            points = []
-            if inter.geom_type == 'Polygon':
-                points = inter.exterior.coords
-            elif inter.geom_type == 'GeometryCollection':
-                for i in inter.geoms:
-                    if i.geom_type == 'Polygon':
-                        for ppp in i.exterior.coords:
-                            points.append([ppp[0], ppp[1]])
-            elif inter.geom_type == 'MultiPolygon':
-                for i in inter.geoms:
-                    if i.geom_type == 'Polygon':
-                        for ppp in i.exterior.coords:
-                            points.append([ppp[0], ppp[1]])
-            else:
-                print(inter)
+            prob[key] = floorfield[ped.i() - window[0].start, ped.j() - window[1].start]
+        else:
+            cells = np.logical_and(neighbor_sectors[key][window], visible)
 
-            if len(points) == 0:
+            if not cells.any():
                 prob[key] = 0
             else:
-                intersection = sg.Polygon(points)
-                intersections.append(intersection)
-
-                inside_cells = grid.get_inside_polygon_cells(geometry, points)
-                combination = inside_cells * weighted_floorfield
-
-                prob[key] = np.ma.max(combination, fill_value=0)
-
+                prob[key] = weighted_floorfield[cells].max()
 
     # weight cells by moving direction
     if weight_direction:
@@ -159,34 +355,3 @@ def compute_prob_neighbors(geometry: Geometry, grid: Grid, ped: Pedestrian, floo
     prob = normalize_dict(prob)
     return prob
 
-
-def compute_voronoi_neighbors(geometry: Geometry, grid: Grid, ped: Pedestrian):
-    neighbors = grid.get_neighbors(geometry, ped.pos)
-    points = {}
-    for key, neighbor in neighbors.items():
-        if neighbor is not None:
-            px, py = grid.get_coordinates(neighbor[0], neighbor[1])
-            points[key] = [px, py]
-
-    # dummy points for voronoi computation
-    points[1000] = [0, 1000000]
-    points[2000] = [0, -1000000]
-    points[3000] = [1000000, 0]
-    points[4000] = [-1000000, 0]
-
-    points_list = list(points.values())
-    vor = Voronoi(list(points.values()))
-    polygons = {}
-    for key, neighbor in neighbors.items():
-        polygons[key] = None
-
-    for i in vor.point_region:
-        region = vor.regions[i]
-        if -1 not in region:
-            polygon = [vor.vertices[i] for i in region]
-            if len(polygon) > 0:
-                key = list(points.keys())[
-                    list(points.values()).index(points_list[np.where(vor.point_region == i)[0][0]])]
-                polygons[key] = sg.Polygon(polygon)
-
-    return polygons
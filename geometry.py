@@ -5,7 +5,7 @@ from typing import Dict, List, Tuple
 from matplotlib import pyplot as plt
 from descartes.patch import PolygonPatch
 from IO import read_geometry
-from pedestrian import Pedestrian
+from pedestrian import Pedestrian, PedestrianStore
 from constants import *
 
 from shapely.geometry import LineString, Point, Polygon
@@ -25,13 +25,14 @@ class Geometry:
     floor: Polygon
     entrances: Dict[int, LineString]
     exits: Dict[int, LineString]
-    pedestrians: Dict[int, Pedestrian]
+    pedestrians: PedestrianStore
     obstacles: Dict[int, Polygon]
     attraction_mounted: Dict[int, Polygon]
     attraction_ground: Dict[int, Polygon]
 
     entrances_properties: Dict[int, Tuple[int, int]]
     env: vis.Environment
+    hash: str
 
     def __init__(self, filename):
         """
@@ -42,14 +43,15 @@ class Geometry:
         self.floor = None
         self.entrances = {}
         self.exits = {}
-        self.pedestrians = {}
+        self.pedestrians = PedestrianStore()
         self.edges = []
         self.obstacles = {}
         self.attraction_ground = {}
         self.attraction_mounted = {}
-        walls, obstacles, entrances, entrances_properties, exits, edges = read_geometry(filename)
+        walls, obstacles, entrances, entrances_properties, exits, edges, geometry_hash = read_geometry(filename)
 
         self.entrances_properties = entrances_properties
+        self.hash = geometry_hash
 
         points = []
         points_vis = []
@@ -13,6 +13,54 @@ from matplotlib.path import Path
 moore = False
 
 
+def points_distance_to_line(x: np.ndarray, y: np.ndarray, coords):
+    """
+    :param x: x coordinates of the points
+    :param y: y coordinates of the points
+    :param coords: vertices of the line (or closed ring)
+    :return: distance of each point (x, y) to the line
+    """
+    coords = np.asarray(coords, dtype=float)
+    distance = np.full(x.shape, np.inf)
+    for (x1, y1), (x2, y2) in zip(coords[:-1], coords[1:]):
+        dx = x2 - x1
+        dy = y2 - y1
+        length = dx * dx + dy * dy
+        if length == 0:
+            t = np.zeros_like(x)
+        else:
+            t = np.clip(((x - x1) * dx + (y - y1) * dy) / length, 0, 1)
+        distance = np.minimum(distance, np.hypot(x - (x1 + t * dx), y - (y1 + t * dy)))
+
+    return distance
+
+
+def points_within_polygon(x: np.ndarray, y: np.ndarray, polygon: Polygon):
+    """
+    Same as Point(x, y).within(polygon) for all points at once, points on the boundary are not within.
+    :param x: x coordinates of the points
+    :param y: y coordinates of the points
+    :param polygon: polygon (with holes) to check
+    :return: matrix with True for points strictly inside the polygon, False otherwise
+    """
+    rings = [polygon.exterior.coords, *[interior.coords for interior in polygon.interiors]]
+
+    # even-odd rule, holes flip the parity back
+    within = np.zeros(x.shape, dtype=bool)
+    on_boundary = np.zeros(x.shape, dtype=bool)
+    for ring in rings:
+        coords = np.asarray(ring, dtype=float)
+        for (x1, y1), (x2, y2) in zip(coords[:-1], coords[1:]):
+            crosses = (y1 > y) != (y2 > y)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                intersection_x = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+            within ^= np.logical_and(crosses, x < intersection_x)
+
+        on_boundary |= points_distance_to_line(x, y, coords) < BOUNDARY_EPSILON
+
+    return np.logical_and(within, np.logical_not(on_boundary))
+
+
 @dataclass
 class Grid:
     """Class holding the grid information"""
@@ -27,11 +75,23 @@ class Grid:
     entrance_cells: np.ndarray
     door_cells: Dict[int, np.ndarray]
     exit_cells: Dict[int, np.ndarray]
+    wall_cells: np.ndarray
+    edge_cells: np.ndarray
+    field_cells: np.ndarray
+    adjacency: np.ndarray
+
+    # cell offsets of the von Neumann neighbors (in order of Neighbors), followed by the diagonal Moore neighbors
+    neighbor_offsets = np.asarray([[0, 0], [-1, 0], [0, 1], [1, 0], [0, -1], [-1, 1], [1, 1], [1, -1], [-1, -1]])
 
-    def __init__(self, geometry: Geometry):
+    static_distances: Dict[str, np.ma.MaskedArray]
+    # static distance fields computed with other backends than fmm, by backend and key of the field
+    backend_static_distances: Dict[str, Dict[str, np.ma.MaskedArray]]
+
+    def __init__(self, geometry: Geometry, layers: Dict[str, np.ndarray] = None):
         """
         Constructs the grid based on the geometry
         :param geometry:
+        :param layers: precomputed layers (see layers()), if None they are computed from the geometry
         """
         minx, miny, maxx, maxy = geometry.get_bounding_box()
 
@@ -47,12 +107,52 @@ class Grid:
         self.dimX = dimX
         self.dimY = dimY
         self.cellsize = CELLSIZE
-
-        self.inside_cells = self.__get_inside_cells(geometry)
-        self.outside_cells = self.__get_outside_cells(geometry)
-        self.door_cells = self.__get_door_cells(geometry)
-        self.entrance_cells = self.__get_entrance_cells(geometry)
-        self.exit_cells = self.__get_exit_cells(geometry)
+        self.static_distances = None
+        self.backend_static_distances = {}
+
+        if layers is not None:
+            self.__set_layers(geometry, layers)
+        else:
+            self.door_cells = self.__get_door_cells(geometry)
+            self.entrance_cells = self.__get_entrance_cells(geometry)
+            self.inside_cells = self.__get_inside_cells(geometry)
+            self.outside_cells = self.__get_outside_cells(geometry)
+            self.exit_cells = self.__get_exit_cells(geometry)
+            self.wall_cells = self.__get_wall_cells(geometry)
+            self.edge_cells = self.__get_edge_cells(geometry)
+
+        # floor fields are plain arrays, which are zero outside of these cells
+        self.field_cells = self.outside_cells != 1
+        self.adjacency = self.__get_adjacency(moore)
+
+    def layers(self):
+        """
+        :return: all layers of the grid as flat dict, can be used to construct the grid again
+        """
+        layers = {'inside_cells': self.inside_cells,
+                  'outside_cells': self.outside_cells,
+                  'entrance_cells': self.entrance_cells,
+                  'wall_cells': self.wall_cells,
+                  'edge_cells': self.edge_cells}
+        for key, door in self.door_cells.items():
+            layers['door_cells_{}'.format(key)] = door
+        for key, exit in self.exit_cells.items():
+            layers['exit_cells_{}'.format(key)] = exit
+        return layers
+
+    def __set_layers(self, geometry: Geometry, layers: Dict[str, np.ndarray]):
+        """
+        Sets the layers of the grid from precomputed ones.
+        :param geometry: Geometry of the layers
+        :param layers: layers of the grid (see layers())
+        """
+        self.inside_cells = layers['inside_cells']
+        self.outside_cells = layers['outside_cells']
+        self.entrance_cells = layers['entrance_cells']
+        self.wall_cells = layers['wall_cells']
+        self.edge_cells = layers['edge_cells']
+        self.door_cells = {key: layers['door_cells_{}'.format(key)] for key in geometry.entrances.keys()}
+        self.exit_cells = {key: layers['exit_cells_{}'.format(key)] for key in geometry.exits.keys()}
 
     def __get_outside_cells(self, geometry: Geometry):
         """
@@ -60,10 +160,7 @@ class Grid:
         :return: matrix with 1 for cells outside the geometry, 0 otherwise
         """
         outside = np.zeros_like(self.gridX)
-        for i in range(self.dimX):
-            for j in range(self.dimY):
-                if self.inside_cells[i][j] == 0:
-                    outside[i][j] = 1
+        outside[self.inside_cells == 0] = 1
         return outside
 
     def __get_inside_cells(self, geometry: Geometry):
@@ -72,13 +169,9 @@ class Grid:
         :return: matrix with 1 for cells inside the geometry, 0 otherwise
         """
         inside = np.zeros_like(self.gridX)
-        for i in range(self.dimX):
-            for j in range(self.dimY):
-                x, y = self.get_coordinates(i, j)
-                if geometry.is_in_geometry(x, y):
-                    inside[i][j] = 1
+        inside[points_within_polygon(self.gridX, self.gridY, geometry.floor)] = 1
 
-        inside = inside + self.__get_entrance_cells(geometry)
+        inside = inside + self.entrance_cells
         return inside
 
     def __get_entrance_cells(self, geometry: Geometry):
@@ -87,13 +180,8 @@ class Grid:
         :return: matrix with 1 for cells containing entrance, 0 otherwise
         """
         entrances = np.zeros_like(self.gridX)
-        for i in range(self.dimX):
-            for j in range(self.dimY):
-                for key, door in geometry.entrances.items():
-                    x, y = self.get_coordinates(i, j)
-                    p = Point((x, y))
-                    if door.distance(p) < THRESHOLD:
-                        entrances[i][j] = 1
+        for door in self.door_cells.values():
+            entrances[door == 1] = 1
 
         return entrances
 
@@ -105,12 +193,7 @@ class Grid:
         doors = {}
         for key, door in geometry.entrances.items():
             entrances = np.zeros_like(self.gridX)
-            for i in range(self.dimX):
-                for j in range(self.dimY):
-                    x, y = self.get_coordinates(i, j)
-                    p = Point((x, y))
-                    if door.distance(p) < THRESHOLD:
-                        entrances[i][j] = 1
+            entrances[points_distance_to_line(self.gridX, self.gridY, door.coords) < THRESHOLD] = 1
             doors[key] = entrances
 
         return doors
@@ -123,25 +206,44 @@ class Grid:
         exits = {}
         for id, exit in geometry.exits.items():
             exit_cells = np.zeros_like(self.gridX)
-            for i in range(self.dimX):
-                for j in range(self.dimY):
-                    x, y = self.get_coordinates(i, j)
-                    p = Point((x, y))
-                    if exit.distance(p) < THRESHOLD:
-                        exit_cells[i][j] = 1
+            exit_cells[points_distance_to_line(self.gridX, self.gridY, exit.coords) < THRESHOLD] = 1
             exits[id] = exit_cells
         return exits
 
-    def get_ped_cells(self, geometry: Geometry, ped: Pedestrian = None):
+    def __get_wall_cells(self, geometry: Geometry):
         """
         :param geometry: Geometry to check
-        :return: matrix with 1 for cells containing ped, 0 otherwise
+        :return: matrix with 1 for cells containing walls, -1 for entrance cells not containing walls, 0 otherwise
         """
-        peds = np.zeros_like(self.gridX)
+        walls = np.zeros_like(self.gridX)
+        for hole in geometry.obstacles.values():
+            near = points_distance_to_line(self.gridX, self.gridY, hole.exterior.coords) < THRESHOLD
+            walls[np.logical_or(near, points_within_polygon(self.gridX, self.gridY, hole))] = 1
+
+        return walls - self.entrance_cells
+
+    def __get_edge_cells(self, geometry: Geometry):
+        """
+        :param geometry: Geometry to check
+        :return: matrix with 1 for cells containing edge, 0 otherwise
+        """
+        edges = np.zeros_like(self.gridX)
+        for edge in geometry.edges:
+            edges[points_distance_to_line(self.gridX, self.gridY, edge.coords) < THRESHOLD] = 1
+
+        return edges
 
-        for key, pped in geometry.pedestrians.items():
-            if ped is not None and ped.id != pped.id:
-                peds[pped.i()][pped.j()] = 1
+    def get_ped_cells(self, ped_cells, ped: Pedestrian = None):
+        """
+        :param ped_cells: True for cells containing a pedestrian (see CA.ped_cells)
+        :param ped: Pedestrian to exclude, if None all pedestrians are included
+        :return: matrix with True for cells containing ped, False otherwise, ped_cells itself if no pedestrian is
+                 excluded (read only)
+        """
+        if ped is None:
+            return ped_cells
+        peds = ped_cells.copy()
+        peds[ped.i(), ped.j()] = False
         return peds
 
     def get_wall_cells(self, geometry: Geometry):
@@ -149,33 +251,14 @@ class Grid:
         :param geometry: Geometry to check
         :return: matrix with 1 for cells containing walls, 0 otherwise
         """
-        walls = np.zeros_like(self.gridX)
-
-        for i in range(self.dimX):
-            for j in range(self.dimY):
-                x, y = self.get_coordinates(i, j)
-                p = Point((x, y))
-                for hole in geometry.obstacles.values():
-                    if hole.distance(p) < THRESHOLD:
-                        walls[i][j] = 1
-
-        return walls - self.__get_entrance_cells(geometry)
+        return self.wall_cells.copy()
 
     def get_edge_cells(self, geometry: Geometry):
         """
         :param geometry: Geometry to check
         :return: matrix with 1 for cells containing edge, 0 otherwise
         """
-        edges = np.zeros_like(self.gridX)
-        for i in range(self.dimX):
-            for j in range(self.dimY):
-                for edge in geometry.edges:
-                    x, y = self.get_coordinates(i, j)
-                    p = Point((x, y))
-                    if edge.distance(p) < THRESHOLD:
-                        edges[i][j] = 1
-
-        return edges
+        return self.edge_cells.copy()
 
     def get_coordinates(self, i: int, j: int):
         """
@@ -188,25 +271,45 @@ class Grid:
 
         return [float("inf"), float("inf")]
 
+    def __get_adjacency(self, moore_neighborhood: bool):
+        """
+        :param moore_neighborhood: if True the diagonal neighbors are included
+        :return: table with the flat indices of the neighbors (self, von Neumann neighbors in order of Neighbors and
+                 diagonal neighbors) of each inside or entrance cell, -1 for neighbors which are not inside or entrance
+                 cells
+        """
+        walkable = np.logical_or(self.inside_cells == 1, self.entrance_cells == 1)
+        flat = np.arange(self.dimX * self.dimY).reshape(self.dimX, self.dimY)
+        offsets = self.neighbor_offsets if moore_neighborhood else self.neighbor_offsets[:len(Neighbors)]
+
+        adjacency = np.full((self.dimX * self.dimY, len(offsets)), -1, dtype=int)
+        cell_i, cell_j = np.nonzero(walkable)
+        for k, (di, dj) in enumerate(offsets):
+            neighbor_i = cell_i + di
+            neighbor_j = cell_j + dj
+            valid = (neighbor_i >= 0) & (neighbor_i < self.dimX) & (neighbor_j >= 0) & (neighbor_j < self.dimY)
+            valid[valid] = walkable[neighbor_i[valid], neighbor_j[valid]]
+            adjacency[flat[cell_i[valid], cell_j[valid]], k] = flat[neighbor_i[valid], neighbor_j[valid]]
+        return adjacency
+
+    def flat_index(self, i, j):
+        """
+        :param i: 1st dimension index of cell
+        :param j: 2nd dimension index of cell
+        :return: flat index of cell (i, j), used in the adjacency table
+        """
+        return i * self.dimY + j
+
     def get_neighbors(self, geometry: Geometry, cell: [int, int]):
         """
          von Neumann neighborhood
         """
-        neighbors = {}
-        i, j = cell
-
-        possibleNeigbors = {}
-        possibleNeigbors[Neighbors.self] = [i, j]
-        possibleNeigbors[Neighbors.left] = [i - 1, j]
-        possibleNeigbors[Neighbors.top] = [i, j + 1]
-        possibleNeigbors[Neighbors.right] = [i + 1, j]
-        possibleNeigbors[Neighbors.bottom] = [i, j - 1]
+        row = self.adjacency[self.flat_index(cell[0], cell[1])]
 
-        entrance = self.entrance_cells
-
-        for key, posNeighbor in possibleNeigbors.items():
-            if self.inside_cells[posNeighbor[0], posNeighbor[1]] == 1 or entrance[posNeighbor[0]][posNeighbor[1]] == 1:
-                neighbors[key] = posNeighbor
+        neighbors = {}
+        for key in Neighbors:
+            if row[key.value] != -1:
+                neighbors[key] = list(divmod(int(row[key.value]), self.dimY))
 
         # not shuffling significantly alters the simulation...
         return neighbors
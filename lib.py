@@ -1,132 +1,139 @@
 import logging
 import os
-import random
 import time
 
 from CA import CA
-from IO import create_output_directory
+from checkpoint import checkpoint_filename, load_checkpoint, save_checkpoint
+from IO import create_output_directory, remove_completion_marker, write_completion_marker
 from constants import *
 from plotting import *
 from simulation_parameters import SimulationParameters
+from spawner import EntranceSpawner
 from trajectory import Trajectory
-import random
+from visibility import VisibilityIndex
+from compiled_geometry import load_compiled_geometry
+from pedestrian import PedestrianStore
 import numpy as np
 
 
-def init(file):
+def init(file, cache_path=None):
     """
     Inits simulation context (used for parallel computations)
     :param file: file containing geometry
+    :param cache_path: directory of the compiled geometry cache, if None the grid is always computed
     :return: geometry and grid for simulation
     """
     geometry = Geometry(file)
-    grid = Grid(geometry)
+    if cache_path is None:
+        grid = Grid(geometry)
+    else:
+        grid = load_compiled_geometry(geometry, cache_path)
     return geometry, grid
 
 
-def create_peds(simulation_parameters: SimulationParameters, geometry: Geometry, grid: Grid):
+def init_cache(file, cache_path):
+    """
+    Computes the compiled geometry and visibility index and stores them in the cache (used before parallel
+    computations)
+    :param file: file containing geometry
+    :param cache_path: directory of the cache
+    """
+    geometry, grid = init(file, cache_path)
+    VisibilityIndex(geometry, grid, cache_path)
+
+
+def create_peds(simulation_parameters: SimulationParameters, geometry: Geometry, grid: Grid, ca: CA):
     """
     Creates the initial pedestrians in the simulation
     :param simulation_parameters: parameters for simulation
     :param geometry: geometry to use
     :param grid: grid to use
+    :param ca: CA of the simulation, provides random number generator and occupancy
     """
+    rng = ca.rng
     for index in range(simulation_parameters.init_agents):
         while True:
-            i = random.randint(0, grid.gridX.shape[0] - 1)
-            j = random.randint(0, grid.gridY.shape[1] - 1)
-
-            if grid.inside_cells[i][j] == 1:
-                occupied = False
-                for ped in geometry.pedestrians.values():
-                    if ped.i() == i and ped.j() == j:
-                        occupied = True
-                        break
+            i = rng.integers(grid.gridX.shape[0])
+            j = rng.integers(grid.gridY.shape[1])
 
-                if not occupied:
-                    exits = [0, 1]
-                    exit_id = np.random.choice(exits, 1, p=simulation_parameters.exit_prob)[0]
+            if grid.inside_cells[i][j] == 1 and not ca.is_occupied(i, j):
+                exits = [0, 1]
+                exit_id = rng.choice(exits, p=simulation_parameters.exit_prob)
 
-                    geometry.pedestrians[index] = Pedestrian([i, j], Neighbors.left, index, False, exit_id)
-                    break
+                ca.add_pedestrian(geometry, [i, j], Neighbors.left, False, exit_id, index)
+                break
 
-    keys = random.sample(list(geometry.pedestrians), simulation_parameters.standing_agents)
+    keys = rng.choice(geometry.pedestrians.keys(), simulation_parameters.standing_agents, replace=False)
     for key in keys:
         geometry.pedestrians[key].standing = True
 
 
-def add_pedestrian(simulation_parameters: SimulationParameters, geometry: Geometry, grid: Grid, step: int):
-    """
-    Add pedestrian at entrances depending on flow to the simulation
-    :param simulation_parameters: parameters of simulation
-    :param geometry: geometry to use
-    :param grid: grid to use
-    :param step: current time step
-    """
-    for key in geometry.entrances.keys():
-        entrance_properties = geometry.entrances_properties[key]
-        if step % entrance_properties[0] == 0:
-            for i in range(geometry.entrances_properties[key][1]):
-                entrances = grid.door_cells[key]
-                entrance_cells = np.transpose(np.where(entrances == 1))
-
-                ped_cells = np.zeros(shape=(len(geometry.pedestrians.items()) + 1, 2))
-
-                for i in range(len(geometry.pedestrians.items())):
-                    ped = geometry.pedestrians[i]
-                    ped_cells[i] = [ped.i(), ped.j()]
-
-                ped_cells[len(geometry.pedestrians.items())] = [41, 9]
-
-                exclude_cells = (entrance_cells[:, None] == ped_cells).all(-1).any(-1)
-                entrance_cells = entrance_cells[exclude_cells == False]
-
-                cell = random.choice(entrance_cells)
-                max_id = 0
-                if len(geometry.pedestrians.items()) != 0:
-                    max_id = max(geometry.pedestrians) + 1
-
-                id = max_id
-                exits = [0, 1]
-                exit_id = np.random.choice(exits, 1, p=simulation_parameters.exit_prob)[0]
-
-                geometry.pedestrians[id] = Pedestrian([cell[0], cell[1]], Neighbors.left, id, False, exit_id)
-
-
-def run_simulation(simulation_parameters: SimulationParameters):
+def run_simulation(simulation_parameters: SimulationParameters, geometry: Geometry = None, grid: Grid = None):
     """
     Runs the simulation with the given parameters
     :param simulation_parameters: parameters of simulation
+    :param geometry: geometry to use (e.g., loaded once per worker process), if None it is read from the file in
+                     simulation_parameters
+    :param grid: grid of the geometry
     :return:
     """
+    checkpoint = None
+    if simulation_parameters.resume:
+        checkpoint = load_checkpoint(simulation_parameters.resume, simulation_parameters)
+
     create_output_directory(simulation_parameters.output_path)
-    file = open(simulation_parameters.file, 'r')
-    random.seed(simulation_parameters.seed)
+    remove_completion_marker(simulation_parameters.output_path)
+    rng = np.random.default_rng(simulation_parameters.seed)
+
+    if geometry is None:
+        geometry, grid = init(simulation_parameters.file, simulation_parameters.cache_path)
+    else:
+        geometry.pedestrians = PedestrianStore()
 
-    geometry, grid = init(file)
+    first_step = 0
+    if checkpoint is not None:
+        first_step, rng_state, next_id, peds_state, traj_state, spawner_state = checkpoint
+        geometry.pedestrians.set_state(peds_state, next_id)
+        rng.bit_generator.state = rng_state
 
-    create_peds(simulation_parameters, geometry, grid)
+    ca = CA(simulation_parameters, geometry, grid, rng)
+
+    spawner = EntranceSpawner(geometry, grid)
+    if checkpoint is None:
+        create_peds(simulation_parameters, geometry, grid, ca)
+    else:
+        spawner.set_state(spawner_state)
 
     if simulation_parameters.plot:
         plot_geometry_peds(geometry, grid, geometry.pedestrians)
 
-    ca = CA(simulation_parameters, geometry, grid)
-
     # Save simulation parameters and static ff
     ca.save(simulation_parameters.output_path)
     simulation_parameters.write_to_file(simulation_parameters.output_path)
 
-    traj = Trajectory(grid, simulation_parameters.steps)
+    traj = Trajectory(grid, simulation_parameters.space_usage_interval)
+    if checkpoint is not None:
+        traj.set_state(traj_state)
+    traj.remove_stale_outputs(simulation_parameters.output_path, first_step)
 
-    for step in range(simulation_parameters.steps):
+    checkpoint_file = checkpoint_filename(simulation_parameters.output_path)
+    for step in range(first_step, simulation_parameters.steps):
         start_time = time.time()
-        if len(geometry.pedestrians.values()) < simulation_parameters.max_agents:
-            add_pedestrian(simulation_parameters, geometry, grid, step)
+        if len(geometry.pedestrians) < simulation_parameters.max_agents:
+            spawner.spawn(simulation_parameters, geometry, step, ca)
 
         ca.compute_step(geometry, grid)
         traj.add_step(step, grid, geometry.pedestrians, simulation_parameters.output_path)
+
+        interval = simulation_parameters.checkpoint_interval
+        if interval > 0 and (step + 1) % interval == 0 and step + 1 < simulation_parameters.steps:
+            save_checkpoint(checkpoint_file, step + 1, simulation_parameters, geometry, ca, traj, spawner)
         end_time = time.time()
         print("Process {} finished step {:3d}/{:3d} in {:4.5f}s".format(os.getpid(), step + 1, simulation_parameters.steps,
                                                                 end_time - start_time))
-    traj.save(simulation_parameters.output_path)
+    ca.close()
+    traj.save(simulation_parameters.output_path, grid, simulation_parameters.traj_csv)
+    if os.path.isfile(checkpoint_file):
+        os.remove(checkpoint_file)
+    write_completion_marker(simulation_parameters.output_path, simulation_parameters.hash())
     return
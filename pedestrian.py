@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+import numpy as np
 from constants import *
 
 
@@ -37,3 +38,291 @@ class Pedestrian:
         else:
             print('something wrong')
         self.pos = new_pos
+
+
+class PedestrianView:
+    """
+    View of a single pedestrian in a PedestrianStore, behaves like Pedestrian.
+    """
+
+    def __init__(self, store, row: int):
+        self.store = store
+        self.row = row
+
+    @property
+    def id(self):
+        return int(self.store.ids[self.row])
+
+    @property
+    def pos(self):
+        return [int(self.store.pos[self.row, 0]), int(self.store.pos[self.row, 1])]
+
+    @property
+    def direction(self):
+        return Neighbors(self.store.direction[self.row])
+
+    @direction.setter
+    def direction(self, direction: Neighbors):
+        self.store.direction[self.row] = direction.value
+
+    @property
+    def standing(self):
+        return bool(self.store.standing[self.row])
+
+    @standing.setter
+    def standing(self, standing: bool):
+        self.store.standing[self.row] = standing
+
+    @property
+    def exit_id(self):
+        return int(self.store.exit_id[self.row])
+
+    @exit_id.setter
+    def exit_id(self, exit_id: int):
+        self.store.exit_id[self.row] = exit_id
+
+    @property
+    def not_moving(self):
+        return int(self.store.not_moving[self.row])
+
+    def i(self):
+        return int(self.store.pos[self.row, 0])
+
+    def j(self):
+        return int(self.store.pos[self.row, 1])
+
+    def set_pos(self, new_pos):
+        self.store.move_rows(np.asarray([self.row]), np.asarray([new_pos]))
+
+
+class PedestrianStore:
+    """
+    Structure of arrays containing the information of all pedestrians. Rows of removed pedestrians are kept in a
+    free-list and reused, ids are never reused. Iteration follows the order in which the pedestrians were added.
+    row_index maps ids to rows (-1 for removed or unused ids), so the rows of many ids are found by one lookup.
+    Supports the dict interface (id -> pedestrian) used for Dict[int, Pedestrian] before, values() and items() are
+    generators creating one view per pedestrian, hence hot paths read the arrays (e.g. positions()) instead.
+    """
+
+    def __init__(self, capacity: int = 64):
+        """
+        :param capacity: initial number of rows
+        """
+        self.pos = np.zeros((capacity, 2), dtype=int)
+        self.direction = np.zeros(capacity, dtype=int)
+        self.standing = np.zeros(capacity, dtype=bool)
+        self.exit_id = np.zeros(capacity, dtype=int)
+        self.not_moving = np.zeros(capacity, dtype=int)
+        self.ids = np.full(capacity, -1, dtype=int)
+        self.row_index = np.full(capacity, -1, dtype=int)
+
+        self.id_to_row = {}
+        self.free_rows = list(range(capacity - 1, -1, -1))
+        self.next_id = 0
+        self.order = None
+
+    def __grow(self):
+        """
+        Doubles the number of rows.
+        """
+        capacity = len(self.ids)
+        self.pos = np.concatenate((self.pos, np.zeros_like(self.pos)))
+        self.direction = np.concatenate((self.direction, np.zeros_like(self.direction)))
+        self.standing = np.concatenate((self.standing, np.zeros_like(self.standing)))
+        self.exit_id = np.concatenate((self.exit_id, np.zeros_like(self.exit_id)))
+        self.not_moving = np.concatenate((self.not_moving, np.zeros_like(self.not_moving)))
+        self.ids = np.concatenate((self.ids, np.full(capacity, -1, dtype=int)))
+        self.free_rows = list(range(2 * capacity - 1, capacity - 1, -1)) + self.free_rows
+
+    def __reserve_ids(self, next_id: int):
+        """
+        Grows row_index (doubling its size) until it holds all ids below next_id.
+        :param next_id: next free id
+        """
+        size = len(self.row_index)
+        while size < next_id:
+            size *= 2
+        if size > len(self.row_index):
+            self.row_index = np.concatenate((self.row_index, np.full(size - len(self.row_index), -1, dtype=int)))
+
+    def add(self, pos: [int, int], direction: Neighbors, standing: bool, exit_id: int, ped_id: int = None):
+        """
+        Adds a new pedestrian.
+        :param pos: cell of the pedestrian
+        :param direction: last moving direction
+        :param standing: pedestrian does not move
+        :param exit_id: exit the pedestrian is heading to
+        :param ped_id: id of the pedestrian, if None the next free id is used
+        :return: id of the new pedestrian
+        """
+        if ped_id is None:
+            ped_id = self.next_id
+        if ped_id in self.id_to_row:
+            raise ValueError('Pedestrian {} already exists'.format(ped_id))
+        self.next_id = max(self.next_id, ped_id + 1)
+        self.__reserve_ids(self.next_id)
+
+        if len(self.free_rows) == 0:
+            self.__grow()
+        row = self.free_rows.pop()
+
+        self.pos[row] = pos
+        self.direction[row] = direction.value
+        self.standing[row] = standing
+        self.exit_id[row] = exit_id
+        self.not_moving[row] = 1
+        self.ids[row] = ped_id
+
+        self.id_to_row[ped_id] = row
+        self.row_index[ped_id] = row
+        self.order = None
+        return ped_id
+
+    def remove(self, ped_id: int):
+        """
+        Removes the pedestrian with ped_id, its row is reused.
+        :param ped_id: id of the pedestrian
+        """
+        row = self.id_to_row.pop(ped_id)
+        self.ids[row] = -1
+        self.row_index[ped_id] = -1
+        self.free_rows.append(row)
+        self.order = None
+
+    def rows(self):
+        """
+        :return: rows of all pedestrians in insertion order
+        """
+        if self.order is None:
+            self.order = np.fromiter(self.id_to_row.values(), dtype=int, count=len(self.id_to_row))
+        return self.order
+
+    def get_ids(self):
+        """
+        :return: ids of all pedestrians in insertion order
+        """
+        return self.ids[self.rows()]
+
+    def positions(self):
+        """
+        :return: cells of all pedestrians in insertion order
+        """
+        return self.pos[self.rows()]
+
+    def exit_ids(self):
+        """
+        :return: exit ids of all pedestrians in insertion order
+        """
+        return self.exit_id[self.rows()]
+
+    def state(self):
+        """
+        :return: arrays of all pedestrians in insertion order (id, pos, direction, standing, exit_id, not_moving)
+        """
+        rows = self.rows()
+        return {'id': self.ids[rows],
+                'pos': self.pos[rows],
+                'direction': self.direction[rows],
+                'standing': self.standing[rows],
+                'exit_id': self.exit_id[rows],
+                'not_moving': self.not_moving[rows]}
+
+    def set_state(self, state, next_id: int = None):
+        """
+        Replaces all pedestrians by the pedestrians in *state* (see state()), rows are assigned in insertion order.
+        :param state: arrays of the pedestrians in insertion order
+        :param next_id: next free id, if None the id after the largest id is used
+        """
+        num_peds = len(state['id'])
+        while len(self.ids) < num_peds:
+            self.__grow()
+
+        self.ids[:] = -1
+        self.ids[:num_peds] = state['id']
+        self.pos[:num_peds] = state['pos']
+        self.direction[:num_peds] = state['direction']
+        self.standing[:num_peds] = state['standing']
+        self.exit_id[:num_peds] = state['exit_id']
+        self.not_moving[:num_peds] = state['not_moving']
+
+        self.id_to_row = dict(zip(self.ids[:num_peds].tolist(), range(num_peds)))
+        self.free_rows = list(range(len(self.ids) - 1, num_peds - 1, -1))
+        if next_id is None:
+            next_id = int(self.ids[:num_peds].max()) + 1 if num_peds > 0 else 0
+        self.next_id = next_id
+        self.__reserve_ids(max(next_id, int(self.ids[:num_peds].max()) + 1 if num_peds > 0 else 0))
+        self.row_index[:] = -1
+        self.row_index[self.ids[:num_peds]] = np.arange(num_peds)
+        self.order = None
+
+    def row_of(self, ped_ids):
+        """
+        :param ped_ids: ids of pedestrians
+        :return: rows of the pedestrians
+        """
+        return self.row_index[np.asarray(ped_ids, dtype=int)]
+
+    def move_rows(self, rows, new_pos):
+        """
+        Moves the pedestrians in rows to their new cells and updates direction and not_moving.
+        :param rows: rows of the pedestrians
+        :param new_pos: new cells of the pedestrians
+        """
+        di = new_pos[:, 0] - self.pos[rows, 0]
+        dj = new_pos[:, 1] - self.pos[rows, 1]
+
+        direction = np.select([np.logical_and(di < 0, dj == 0),
+                               np.logical_and(di > 0, dj == 0),
+                               np.logical_and(di == 0, dj < 0),
+                               np.logical_and(di == 0, dj > 0),
+                               np.logical_and(di == 0, dj == 0)],
+                              [Neighbors.left.value,
+                               Neighbors.right.value,
+                               Neighbors.bottom.value,
+                               Neighbors.top.value,
+                               Neighbors.self.value], default=-1)
+        if np.any(direction == -1):
+            print('something wrong')
+
+        valid = direction != -1
+        moved = np.logical_and(valid, direction != Neighbors.self.value)
+        stayed = direction == Neighbors.self.value
+
+        self.direction[rows[valid]] = direction[valid]
+        self.not_moving[rows[moved]] = 1
+        self.not_moving[rows[stayed]] += 1
+        self.pos[rows] = new_pos
+
+    def __len__(self):
+        return len(self.id_to_row)
+
+    def __iter__(self):
+        return iter(list(self.id_to_row.keys()))
+
+    def __contains__(self, ped_id):
+        return ped_id in self.id_to_row
+
+    def __getitem__(self, ped_id):
+        return PedestrianView(self, self.id_to_row[ped_id])
+
+    def __setitem__(self, ped_id, ped: Pedestrian):
+        if ped_id in self.id_to_row:
+            self.remove(ped_id)
+        self.add(ped.pos, ped.direction, ped.standing, ped.exit_id, ped_id)
+        self.not_moving[self.id_to_row[ped_id]] = ped.not_moving
+
+    def __delitem__(self, ped_id):
+        self.remove(ped_id)
+
+    def keys(self):
+        return list(self.id_to_row.keys())
+
+    def values(self):
+        return (PedestrianView(self, row) for row in self.id_to_row.values())
+
+    def items(self):
+        return ((ped_id, PedestrianView(self, row)) for ped_id, row in self.id_to_row.items())
+
+    def clear(self):
+        for ped_id in list(self.id_to_row.keys()):
+            self.remove(ped_id)
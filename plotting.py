@@ -55,6 +55,8 @@ def plot_prob_field(geometry: Geometry, grid: Grid, prob_field, title="", ped=No
         x = grid.gridX[ped.i()][ped.j()]
         y = grid.gridY[ped.i()][ped.j()]
 
+    # floor fields are plain arrays, hide the cells without floor field
+    prob_field = np.ma.MaskedArray(prob_field, ~grid.field_cells)
     pc = plt.pcolor(grid.gridX / MTOMM, grid.gridY / MTOMM, prob_field, cmap=cm.jet, vmin=0, vmax=2)
 
     plt.axis('equal')
@@ -7,7 +7,7 @@ import sys
 import multiprocessing
 
 from simulation_parameters import *
-from lib import run_simulation
+from sweep import run_sweep
 
 import time
 
@@ -75,18 +75,12 @@ def setup_simulation(agents):
             para.plot = False
             para.file = file
             para.w_direction = w_direction
+            para.checkpoint_interval = 30
             parameters.append(para)
 
     return parameters
 
 
-def start_simulation(sim_parameters):
-    try:
-        return None, run_simulation(sim_parameters)
-    except Exception as e:
-        return e, None
-
-
 if __name__ == '__main__':
     num_agents = int(sys.argv[1])
     start = int(sys.argv[2])
@@ -96,10 +90,8 @@ if __name__ == '__main__':
     print('run {} simulations with {} processes'.format(end - start, multiprocessing.cpu_count()))
     start_time = time.time()
 
-    pool = multiprocessing.Pool(multiprocessing.cpu_count())
-    pool.map_async(start_simulation, parameters[int(start):int(end)])
-    pool.close()
-    pool.join()
+    run_sweep(parameters[int(start):int(end)], multiprocessing.cpu_count(),
+              os.path.join('results-ff', 'manifest-{}-{}.csv'.format(start, end)))
     end_time = time.time()
 
     print("Time needed: {}".format(end_time - start_time))
@@ -0,0 +1,74 @@
+from typing import List
+
+import numpy as np
+
+from constants import *
+from grid import Grid
+
+
+class SectorTemplates:
+    """
+    Voronoi sectors of the von Neumann neighbors of a cell. On a regular grid the sectors only depend on which
+    neighbors are available, hence they are precomputed once for every availability pattern as masks of cell offsets
+    and translated to the cell of the pedestrian. Cells with the same distance to two neighbors belong to both sectors.
+    """
+    offsets = {
+        Neighbors.self: (0, 0),
+        Neighbors.left: (-1, 0),
+        Neighbors.top: (0, 1),
+        Neighbors.right: (1, 0),
+        Neighbors.bottom: (0, -1)
+    }
+
+    def __init__(self, grid: Grid):
+        """
+        Computes the sector templates for all availability patterns.
+        :param grid: grid to use
+        """
+        self.dimX = grid.dimX
+        self.dimY = grid.dimY
+
+        di, dj = np.meshgrid(np.arange(-(self.dimX - 1), self.dimX), np.arange(-(self.dimY - 1), self.dimY),
+                             indexing='ij')
+
+        neighbor_keys = [key for key in Neighbors if key != Neighbors.self]
+        squared_distance = {}
+        for key, (oi, oj) in self.offsets.items():
+            squared_distance[key] = (di - oi) ** 2 + (dj - oj) ** 2
+
+        # templates[pattern][k] is the sector of the k-th neighbor (left, top, right, bottom)
+        self.templates = np.zeros((2 ** len(neighbor_keys), len(neighbor_keys), *di.shape), dtype=bool)
+        for pattern in range(2 ** len(neighbor_keys)):
+            available = [key for key in neighbor_keys if pattern & self.pattern_bit(key)]
+            closest = np.minimum.reduce([squared_distance[key] for key in [Neighbors.self, *available]])
+            for key in available:
+                self.templates[pattern, key.value - 1] = squared_distance[key] == closest
+
+    @staticmethod
+    def pattern_bit(key: Neighbors):
+        """
+        :param key: neighbor
+        :return: bit of the neighbor in the availability pattern
+        """
+        return 1 << (key.value - 1)
+
+    def sector_cells(self, i: int, j: int, neighbors: List[Neighbors]):
+        """
+        :param i: 1st dimension index of cell
+        :param j: 2nd dimension index of cell
+        :param neighbors: available neighbors of the cell (see Grid.adjacency)
+        :return: matrix with True for cells in the sector of each available neighbor (except self), views into the
+                 templates
+        """
+        pattern = 0
+        for key in neighbors:
+            if key != Neighbors.self:
+                pattern |= self.pattern_bit(key)
+
+        window = (slice(self.dimX - 1 - i, 2 * self.dimX - 1 - i), slice(self.dimY - 1 - j, 2 * self.dimY - 1 - j))
+
+        sectors = {}
+        for key in neighbors:
+            if key != Neighbors.self:
+                sectors[key] = self.templates[pattern, key.value - 1][window]
+        return sectors
@@ -1,4 +1,8 @@
 from dataclasses import dataclass
+import hashlib
+import json
+
+import numpy as np
 import pandas as pd
 import os
 
@@ -20,6 +24,15 @@ class SimulationParameters:
     # for ped distance
     ped_b: float = 1
     ped_c: float = 1
+    shared_ped_field: bool = False
+    # max error of the sigmoid lookup table, 0 for the exact sigmoid
+    sigmoid_error: float = 0
+
+    # distance backends of the pedestrian, wall, exit and entrance distance ('fmm', 'edt' or 'graph')
+    ped_distance_backend: str = 'fmm'
+    wall_distance_backend: str = 'fmm'
+    exit_distance_backend: str = 'fmm'
+    entrance_distance_backend: str = 'fmm'
 
     # for door distance (flow avoidance)
     door_b: float = 1
@@ -44,10 +57,26 @@ class SimulationParameters:
 
     w_direction: bool = False
 
+    # neighbor probabilities only consider cells within window_radius (in m), 0 for no limit
+    window_radius: float = 0
+
+    # number of processes computing the pedestrians of one step, 1 for serial computation
+    step_workers: int = 1
+    # compute the next steps with the compiled kernel (needs numba and shared_ped_field)
+    step_kernel: bool = False
+
+    # a checkpoint is written every checkpoint_interval steps, 0 for no checkpoints
+    checkpoint_interval: int = 0
+
     plot: bool = False
+    traj_csv: bool = False
+    space_usage_interval: int = 0
 
     exit_prob = [0.5, 0.5]
     output_path = 'results'
+    cache_path = '.cache'
+    # checkpoint the simulation is resumed from, '' to start a new simulation
+    resume = ''
 
     def __init__(self, *args, **kwargs):
         if len(args) == 1:
@@ -90,31 +119,85 @@ class SimulationParameters:
 
         self.ped_b = args.ped_b
         self.ped_c = args.ped_c
+        self.shared_ped_field = args.shared_ped_field
+        self.sigmoid_error = args.sigmoid_error
+        self.window_radius = args.window_radius
+        self.step_workers = args.step_workers
+        self.ped_distance_backend = args.ped_distance_backend
+        self.wall_distance_backend = args.wall_distance_backend
+        self.exit_distance_backend = args.exit_distance_backend
+        self.entrance_distance_backend = args.entrance_distance_backend
+        self.step_kernel = args.step_kernel
+        self.checkpoint_interval = args.checkpoint_interval
+        self.resume = args.resume
 
         self.plot = args.plot
+        self.traj_csv = args.traj_csv
+        self.space_usage_interval = args.space_usage_interval
         self.output_path = args.output_path
+        self.cache_path = args.cache_path
+
+    def to_dict(self):
+        """
+        :return: parameters written to the output directory (name -> value)
+        """
+        return {'seed': self.seed,
+                'steps': self.steps,
+                'max_agents': self.max_agents,
+                'init_agents': self.init_agents,
+                'standing_agents': self.standing_agents,
+                'exit_prob': self.exit_prob,
+                'w_exit': self.w_exit,
+                'w_wall': self.w_wall,
+                'w_door': self.w_door,
+                'w_attraction': self.w_attraction,
+                'w_direction': self.w_direction,
+                'exit_b': self.exit_b,
+                'exit_c': self.exit_c,
+                'wall_b': self.wall_b,
+                'wall_c': self.wall_c,
+                'door_b': self.door_b,
+                'door_c': self.door_c,
+                'att_ground_b': self.attraction_ground_b,
+                'att_ground_c': self.attraction_ground_c,
+                'att_mounted_b': self.attraction_mounted_b,
+                'att_mounted_c': self.attraction_mounted_c,
+                'ped_b': self.ped_b,
+                'ped_c': self.ped_c,
+                'shared_ped_field': self.shared_ped_field,
+                'sigmoid_error': self.sigmoid_error,
+                'window_radius': self.window_radius,
+                'ped_distance_backend': self.ped_distance_backend,
+                'wall_distance_backend': self.wall_distance_backend,
+                'exit_distance_backend': self.exit_distance_backend,
+                'entrance_distance_backend': self.entrance_distance_backend,
+                'step_workers': self.step_workers,
+                'step_kernel': self.step_kernel,
+                'checkpoint_interval': self.checkpoint_interval,
+                'traj_csv': self.traj_csv,
+                'space_usage_interval': self.space_usage_interval,
+                'file': self.file}
+
+    def static_distance_backends(self):
+        """
+        :return: distance backend of each static field type (see compute_static_distances)
+        """
+        return {'wall': self.wall_distance_backend,
+                'exit': self.exit_distance_backend,
+                'entrance': self.entrance_distance_backend}
+
+    def hash(self):
+        """
+        :return: hash of all parameters influencing the results or the written output files, numpy and python numbers
+                 lead to the same hash
+        """
+        # step workers, step kernel and checkpoints do not change the results
+        parameters = {key: np.asarray(value).tolist() for key, value in self.to_dict().items()
+                      if key not in ['step_workers', 'step_kernel', 'checkpoint_interval']}
+        return hashlib.sha1(json.dumps(parameters, sort_keys=True).encode('utf-8')).hexdigest()
 
     def write_to_file(self, output_path):
-        df = pd.DataFrame({'seed': [self.seed],
-                           'steps': [self.steps],
-                           'max_agents': [self.max_agents],
-                           'init_agents': [self.init_agents],
-                           'standing_agents': [self.standing_agents],
-                           'exit_prob': [self.exit_prob],
-                           'w_exit': [self.w_exit],
-                           'w_wall': [self.w_wall],
-                           'w_attraction': [self.w_attraction],
-                           'exit_b': [self.exit_b],
-                           'exit_c': [self.exit_c],
-                           'wall_b': [self.wall_b],
-                           'wall_c': [self.wall_c],
-                           'att_ground_b': [self.attraction_ground_b],
-                           'att_ground_c': [self.attraction_ground_c],
-                           'att_mounted_b': [self.attraction_mounted_b],
-                           'att_mounted_c': [self.attraction_mounted_c],
-                           'ped_b': [self.ped_b],
-                           'ped_c': [self.ped_c],
-                           'file': [self.file]})
+        df = pd.DataFrame({key: [value] for key, value in self.to_dict().items()})
 
         filename = os.path.join(output_path, 'simulation_parameters.csv')
         df.to_csv(filename)
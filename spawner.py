@@ -0,0 +1,88 @@
+import heapq
+
+from CA import CA
+from constants import *
+from geometry import Geometry
+from grid import Grid
+from simulation_parameters import SimulationParameters
+
+import numpy as np
+
+
+class EntranceSpawner:
+    """
+    Spawns pedestrians at the entrances. Entrance k releases *number* pedestrians every *frequency* steps (see
+    Geometry.entrances_properties), the next spawn step of each entrance is kept in an event queue. The cells of each
+    entrance are computed once, free cells are looked up in the occupancy of the CA.
+    """
+    entrance_cells = None
+    events = None
+
+    def __init__(self, geometry: Geometry, grid: Grid):
+        """
+        Init the spawner, all entrances spawn in the first step.
+        :param geometry: geometry to use
+        :param grid: grid to use
+        """
+        self.entrances_properties = geometry.entrances_properties
+        self.entrance_cells = {key: np.argwhere(grid.door_cells[key] == 1) for key in geometry.entrances.keys()}
+
+        self.events = [(0, key) for key in geometry.entrances.keys()]
+        heapq.heapify(self.events)
+
+    def spawn(self, simulation_parameters: SimulationParameters, geometry: Geometry, step: int, ca: CA):
+        """
+        Adds the pedestrians of all entrances spawning in the current step. Spawn steps which passed without calling
+        spawn (e.g., because max_agents was reached) are skipped.
+        :param simulation_parameters: parameters of simulation
+        :param geometry: geometry to use
+        :param step: current time step
+        :param ca: CA of the simulation, provides random number generator and occupancy
+        """
+        while self.events and self.events[0][0] <= step:
+            event_step, key = heapq.heappop(self.events)
+            frequency, number = self.entrances_properties[key]
+
+            if event_step == step:
+                self.spawn_entrance(simulation_parameters, geometry, key, number, ca)
+
+            next_step = event_step + frequency * ((step - event_step) // frequency + 1)
+            heapq.heappush(self.events, (next_step, key))
+
+    def state(self):
+        """
+        :return: pending spawn events as array (step, entrance id)
+        """
+        return {'events': np.asarray(sorted(self.events), dtype=int).reshape(-1, 2)}
+
+    def set_state(self, state):
+        """
+        Restores the pending spawn events.
+        :param state: pending spawn events (see state())
+        """
+        self.events = [(int(step), int(key)) for step, key in state['events']]
+        heapq.heapify(self.events)
+
+    def spawn_entrance(self, simulation_parameters: SimulationParameters, geometry: Geometry, key: int, number: int,
+                       ca: CA):
+        """
+        Adds up to *number* pedestrians on distinct free cells of the entrance.
+        :param simulation_parameters: parameters of simulation
+        :param geometry: geometry to use
+        :param key: id of the entrance
+        :param number: number of pedestrians to add
+        :param ca: CA of the simulation, provides random number generator and occupancy
+        :return: ids of the added pedestrians
+        """
+        cells = self.entrance_cells[key]
+        free_cells = cells[ca.occupancy[cells[:, 0], cells[:, 1]] == -1]
+
+        # pedestrians not fitting on the entrance are not spawned
+        number = min(number, len(free_cells))
+        chosen = ca.rng.choice(len(free_cells), number, replace=False)
+
+        exits = [0, 1]
+        exit_ids = ca.rng.choice(exits, number, p=simulation_parameters.exit_prob)
+
+        return [ca.add_pedestrian(geometry, [cell[0], cell[1]], Neighbors.left, False, exit_id)
+                for cell, exit_id in zip(free_cells[chosen], exit_ids)]
@@ -0,0 +1,226 @@
+import numpy as np
+
+from constants import *
+from distanceCalculator import SharedPedDistance
+from floorfield import PointWeightKernel, ped_distance_to_prob
+from geometry import Geometry
+from grid import Grid
+from sectors import SectorTemplates
+from simulation_parameters import SimulationParameters
+from visibility import VisibilityIndex
+
+try:
+    from numba import njit, prange
+
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        """
+        Without numba the kernel runs as plain python (only used to check it against the reference path).
+        """
+        return lambda function: function
+
+
+@njit(parallel=True, cache=True)
+def step_kernel(pos_i, pos_j, exit_ids, directions, standing, ped_ids, uniforms, static_ff, ped_prob, own_prob,
+                nearest_id, bits, inside_bits, cells_i, cells_j, cell_index, adjacency, templates, point_weight,
+                direction_weights, weight_direction, radius):
+    """
+    Computes the probabilities of the neighboring fields and the next step of all pedestrians, same as
+    CA.compute_probs and CA.compute_next_steps with the shared pedestrian distance.
+    :param pos_i: 1st dimension index of the cells of the pedestrians
+    :param pos_j: 2nd dimension index of the cells of the pedestrians
+    :param exit_ids: exits of the pedestrians
+    :param directions: last moving directions of the pedestrians as Neighbors values
+    :param standing: pedestrians do not move
+    :param ped_ids: ids of the pedestrians
+    :param uniforms: uniform random numbers in [0, 1) drawing the next steps
+    :param static_ff: static floor fields indexed by exit id
+    :param ped_prob: pedestrian probability of cells closest to another pedestrian
+    :param own_prob: pedestrian probability of cells closest to the pedestrian itself
+    :param nearest_id: id of the closest pedestrian for each cell
+    :param bits: packed visibility bitsets (see VisibilityIndex)
+    :param inside_bits: packed bitset of the inside cells
+    :param cells_i: 1st dimension index of the walkable cells
+    :param cells_j: 2nd dimension index of the walkable cells
+    :param cell_index: index of each cell in the walkable cells
+    :param adjacency: adjacency table of the grid (see Grid.adjacency)
+    :param templates: sector templates (see SectorTemplates)
+    :param point_weight: distance weight kernel (see PointWeightKernel)
+    :param direction_weights: weight of each neighbor by moving direction (see weighted_neighbors)
+    :param weight_direction: weight neighbors by moving direction
+    :param radius: only cells within radius (in number of cells) are considered, 0 for no limit
+    :return: probabilities of the neighboring fields indexed by Neighbors value, next steps as Neighbors values
+    """
+    num_peds = len(pos_i)
+    num_neighbors = adjacency.shape[1]
+    dim_x = cell_index.shape[0]
+    dim_y = cell_index.shape[1]
+
+    probs = np.zeros((num_peds, num_neighbors))
+    steps = np.zeros(num_peds, dtype=np.int64)
+
+    for index in prange(num_peds):
+        i = pos_i[index]
+        j = pos_j[index]
+        prob = probs[index]
+
+        if standing[index]:
+            prob[0] = 1.
+        else:
+            neighbors = adjacency[i * dim_y + j]
+            pattern = 0
+            for key in range(1, num_neighbors):
+                if neighbors[key] != -1:
+                    pattern |= 1 << (key - 1)
+
+            offset_i = dim_x - 1 - i
+            offset_j = dim_y - 1 - j
+            exit_id = exit_ids[index]
+            ped_id = ped_ids[index]
+
+            # max of the weighted floor field of the visible cells in each sector, the padding bits of inside_bits
+            # are not set
+            row = bits[cell_index[i, j]]
+            for byte in range(len(row)):
+                visible = row[byte] & inside_bits[byte]
+                if visible == 0:
+                    continue
+                for bit in range(8):
+                    if visible & (0x80 >> bit) == 0:
+                        continue
+
+                    cell = byte * 8 + bit
+                    ci = cells_i[cell]
+                    cj = cells_j[cell]
+                    if radius > 0 and (ci - i) ** 2 + (cj - j) ** 2 > radius ** 2:
+                        continue
+
+                    if nearest_id[ci, cj] == ped_id:
+                        individual = own_prob[ci, cj]
+                    else:
+                        individual = ped_prob[ci, cj]
+                    weighted = point_weight[offset_i + ci, offset_j + cj] * (static_ff[exit_id, ci, cj] * individual)
+
+                    for key in range(1, num_neighbors):
+                        if neighbors[key] != -1 and templates[pattern, key - 1, offset_i + ci, offset_j + cj]:
+                            if weighted > prob[key]:
+                                prob[key] = weighted
+
+            if neighbors[0] != -1:
+                if nearest_id[i, j] == ped_id:
+                    prob[0] = static_ff[exit_id, i, j] * own_prob[i, j]
+                else:
+                    prob[0] = static_ff[exit_id, i, j] * ped_prob[i, j]
+
+            # weight cells by moving direction
+            if weight_direction:
+                weight_sum = 0.
+                for key in range(num_neighbors):
+                    if neighbors[key] != -1:
+                        weight_sum += direction_weights[directions[index], key]
+                for key in range(num_neighbors):
+                    if neighbors[key] != -1:
+                        prob[key] = prob[key] * (direction_weights[directions[index], key] / weight_sum)
+
+            prob_sum = 0.
+            for key in range(num_neighbors):
+                if neighbors[key] != -1:
+                    prob_sum += prob[key]
+            for key in range(num_neighbors):
+                if neighbors[key] != -1:
+                    prob[key] = prob[key] / prob_sum
+
+        # inverse CDF draw, rounding may not lead to neighbors with probability 0
+        cdf = 0.
+        total = 0.
+        for key in range(num_neighbors):
+            total += prob[key]
+        uniform = uniforms[index] * total
+        step = 0
+        last = num_neighbors - 1
+        for key in range(num_neighbors):
+            cdf += prob[key]
+            if cdf <= uniform:
+                step += 1
+        while last > 0 and not prob[last] > 0:
+            last -= 1
+        if not prob[last] > 0:
+            last = num_neighbors - 1
+        steps[index] = min(step, last)
+
+    return probs, steps
+
+
+class StepKernel:
+    """
+    Computes the probabilities of the neighboring fields and the next steps of all pedestrians in one compiled loop
+    over flat arrays (needs numba). Only the shared pedestrian distance can be expressed by flat arrays, with one FMM
+    per pedestrian CA.compute_probs is used.
+    """
+
+    def __init__(self, grid: Grid, visibility: VisibilityIndex, sectors: SectorTemplates,
+                 point_weight: PointWeightKernel, static_ff):
+        """
+        Collects the precomputed data of the grid as flat arrays.
+        :param grid: grid to use
+        :param visibility: cell to cell visibility index
+        :param sectors: Voronoi sector templates of the neighbors
+        :param point_weight: distance weight of the floor field seen by a pedestrian
+        :param static_ff: static floor field of each exit
+        """
+        self.bits = np.asarray(visibility.bits)
+        self.inside_bits = visibility.inside_bits
+        self.cells_i = visibility.cells_i
+        self.cells_j = visibility.cells_j
+        self.cell_index = visibility.cell_index
+        self.adjacency = grid.adjacency[:, :len(Neighbors)]
+        self.templates = sectors.templates
+        self.point_weight = point_weight.kernel
+        self.direction_weights = np.asarray([[weighted_neighbors[direction][key] for key in Neighbors]
+                                             for direction in Neighbors])
+        self.set_static_ff(static_ff)
+
+    def set_static_ff(self, static_ff):
+        """
+        :param static_ff: static floor field of each exit
+        """
+        self.static_ff = np.zeros((max(static_ff.keys()) + 1, *next(iter(static_ff.values())).shape))
+        for exit_id, ff in static_ff.items():
+            self.static_ff[exit_id] = ff
+
+    def compute_step(self, geometry: Geometry, grid: Grid, simulation_parameters: SimulationParameters,
+                     shared_ped_distance: SharedPedDistance, rng: np.random.Generator):
+        """
+        :param geometry: geometry to use
+        :param grid: grid to use
+        :param simulation_parameters: parameters of simulation
+        :param shared_ped_distance: pedestrian distance information of the current step, None if there is at most
+                                    one pedestrian
+        :param rng: random number generator of the simulation
+        :return: probabilities of the neighboring fields for each pedestrian in insertion order, indexed by Neighbors
+                 value, next steps as Neighbors values
+        """
+        state = geometry.pedestrians.state()
+
+        if shared_ped_distance is None:
+            ped_prob = np.ones_like(grid.gridX)
+            own_prob = ped_prob
+            nearest_id = np.full(grid.gridX.shape, -1, dtype=int)
+        else:
+            ped_prob = ped_distance_to_prob(grid, shared_ped_distance.distance, simulation_parameters)
+            own_prob = ped_distance_to_prob(grid, shared_ped_distance.second_distance - PED_DISTANCE_OFFSET,
+                                            simulation_parameters)
+            nearest_id = shared_ped_distance.nearest_id
+
+        uniforms = rng.random(len(state['id']))
+        radius = simulation_parameters.window_radius * MTOMM / grid.cellsize
+
+        return step_kernel(state['pos'][:, 0], state['pos'][:, 1], state['exit_id'], state['direction'],
+                           state['standing'], state['id'], uniforms, self.static_ff, ped_prob, own_prob, nearest_id,
+                           self.bits, self.inside_bits, self.cells_i, self.cells_j, self.cell_index, self.adjacency,
+                           self.templates, self.point_weight, self.direction_weights,
+                           bool(simulation_parameters.w_direction), radius)
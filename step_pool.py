@@ -0,0 +1,149 @@
+import ctypes
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
+
+import numpy as np
+
+from distanceCalculator import SharedPedDistance
+from geometry import Geometry
+from grid import Grid
+from pedestrian import PedestrianView
+
+worker_context = None
+"""CA, geometry, grid and step pool of the worker process, set by init_worker."""
+
+
+def shared_array(shape, dtype):
+    """
+    :param shape: shape of the array
+    :param dtype: data type of the array
+    :return: array in shared memory, visible to all processes forked afterwards
+    """
+    dtype = np.dtype(dtype)
+    buffer = RawArray(ctypes.c_byte, max(int(np.prod(shape)), 1) * dtype.itemsize)
+    return np.frombuffer(buffer, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+
+def init_worker(ca, geometry: Geometry, grid: Grid, step_pool):
+    """
+    Inits the worker process, the arguments are inherited from the main process (fork).
+    :param ca: CA of the simulation
+    :param geometry: geometry to use
+    :param grid: grid to use
+    :param step_pool: step pool holding the shared arrays
+    """
+    global worker_context
+    worker_context = ca, geometry, grid, step_pool
+    step_pool.loaded_step = -1
+
+
+def compute_probs_chunk(task):
+    """
+    Computes the probabilities of the neighboring fields of a contiguous range of pedestrians in the worker process.
+    :param task: step, first and last (exclusive) index of the pedestrians, number of pedestrians and if the shared
+                 pedestrian distance is used
+    :return: Probabilities of the neighboring fields for each pedestrian in the range, indexed by Neighbors value
+    """
+    ca, geometry, grid, step_pool = worker_context
+    step, start, stop, num_peds, use_shared = task
+
+    # the pedestrians are loaded once per step, even if the worker computes several ranges
+    if step_pool.loaded_step != step:
+        geometry.pedestrians.set_state({key: values[:num_peds] for key, values in step_pool.peds.items()})
+        step_pool.loaded_step = step
+
+    shared_ped_distance = step_pool.shared_ped_distance if use_shared else None
+    peds = [PedestrianView(geometry.pedestrians, row) for row in geometry.pedestrians.rows()[start:stop]]
+    return ca.compute_probs(geometry, grid, peds, shared_ped_distance)
+
+
+class StepPool:
+    """
+    Pool of worker processes computing the probabilities of the neighboring fields of the pedestrians within one step.
+
+    Static floor fields, occupancy, pedestrian cells, pedestrians and shared pedestrian distance live in shared memory,
+    the main process updates them before each step. Grid layers, visibility index, sector templates and distance kernel
+    are only read and inherited by the forked workers (copy-on-write, the pages are shared as long as they are not
+    written). The workers only return probabilities, the next steps are drawn and applied in the main process, hence
+    the results are identical to the serial computation.
+    """
+    pool = None
+    peds = None
+    occupancy = None
+    ped_cells = None
+    shared_ped_distance: SharedPedDistance = None
+    step = 0
+    loaded_step = -1
+
+    def __init__(self, ca, geometry: Geometry, grid: Grid, num_workers: int):
+        """
+        Moves the state of *ca* read by the workers to shared memory and starts the workers, needs the fork start
+        method (not available on Windows).
+        :param ca: CA of the simulation, occupancy, pedestrian cells and static floor fields are replaced by shared
+                   arrays
+        :param geometry: geometry to use
+        :param grid: grid to use
+        :param num_workers: number of worker processes
+        """
+        self.num_workers = num_workers
+
+        self.occupancy = shared_array(grid.gridX.shape, ca.occupancy.dtype)
+        self.occupancy[:] = ca.occupancy
+        ca.occupancy = self.occupancy
+        self.ped_cells = shared_array(grid.gridX.shape, ca.ped_cells.dtype)
+        self.ped_cells[:] = ca.ped_cells
+        ca.ped_cells = self.ped_cells
+
+        static_ff = {}
+        for exit_id, ff in ca.static_ff.items():
+            static_ff[exit_id] = shared_array(ff.shape, ff.dtype)
+            static_ff[exit_id][:] = ff
+        ca.static_ff = static_ff
+
+        # every pedestrian occupies one cell, hence the number of cells is an upper bound
+        capacity = grid.dimX * grid.dimY
+        state = geometry.pedestrians.state()
+        self.peds = {key: shared_array((capacity, *values.shape[1:]), values.dtype) for key, values in state.items()}
+
+        self.shared_ped_distance = SharedPedDistance(shared_array(grid.gridX.shape, float),
+                                                     shared_array(grid.gridX.shape, int),
+                                                     shared_array(grid.gridX.shape, float))
+
+        context = multiprocessing.get_context('fork')
+        self.pool = context.Pool(num_workers, initializer=init_worker, initargs=(ca, geometry, grid, self))
+
+    def compute_probs(self, geometry: Geometry, shared_ped_distance: SharedPedDistance = None):
+        """
+        Computes the probabilities of the neighboring fields of all pedestrians in the worker processes, the
+        pedestrians are split into contiguous ranges.
+        :param geometry: geometry to use
+        :param shared_ped_distance: pedestrian distance information of the current step, if None the distance is
+                                    computed for each pedestrian
+        :return: Probabilities of the neighboring fields for each pedestrian in insertion order, indexed by Neighbors
+                 value
+        """
+        state = geometry.pedestrians.state()
+        num_peds = len(state['id'])
+        for key, values in state.items():
+            self.peds[key][:num_peds] = values
+
+        if shared_ped_distance is not None:
+            self.shared_ped_distance.distance[:] = shared_ped_distance.distance
+            self.shared_ped_distance.nearest_id[:] = shared_ped_distance.nearest_id
+            self.shared_ped_distance.second_distance[:] = shared_ped_distance.second_distance
+
+        # several ranges per worker to balance pedestrians with different visible areas
+        num_chunks = max(min(num_peds, 4 * self.num_workers), 1)
+        bounds = np.linspace(0, num_peds, num_chunks + 1).astype(int)
+        tasks = [(self.step, start, stop, num_peds, shared_ped_distance is not None)
+                 for start, stop in zip(bounds[:-1], bounds[1:])]
+        self.step += 1
+
+        return np.concatenate(self.pool.map(compute_probs_chunk, tasks, chunksize=1))
+
+    def close(self):
+        """
+        Stops the worker processes.
+        """
+        self.pool.close()
+        self.pool.join()
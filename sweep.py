@@ -0,0 +1,134 @@
+import multiprocessing
+import os
+import time
+import traceback
+
+import pandas as pd
+
+from lib import run_simulation, init, init_cache
+from IO import is_completed
+from checkpoint import checkpoint_filename, is_resumable
+from simulation_parameters import SimulationParameters
+
+worker_geometries = {}
+"""Geometry and grid of each geometry file in the worker process, set by init_worker."""
+
+
+def expected_cost(simulation_parameters: SimulationParameters):
+    """
+    :param simulation_parameters: parameters of the simulation
+    :return: expected run time of the simulation (arbitrary unit), the cost of a step grows with the number of
+             pedestrians
+    """
+    return simulation_parameters.steps * max(simulation_parameters.max_agents, 1)
+
+
+def init_worker(files, cache_path):
+    """
+    Loads the geometries once per worker process, all simulations of the worker reuse them.
+    :param files: geometry files of the sweep
+    :param cache_path: directory of the compiled geometry cache
+    """
+    for file in files:
+        worker_geometries[file] = init(file, cache_path)
+
+
+def run_task(task):
+    """
+    Runs one simulation of the sweep in the worker process, exceptions are returned instead of raised.
+    :param task: index of the simulation in the sweep and its parameters
+    :return: index, status ('done' or 'failed'), run time in s and error message of the simulation
+    """
+    index, simulation_parameters = task
+    start_time = time.time()
+    try:
+        geometry, grid = worker_geometries.get(simulation_parameters.file, (None, None))
+        run_simulation(simulation_parameters, geometry, grid)
+        return index, 'done', time.time() - start_time, ''
+    except Exception:
+        return index, 'failed', time.time() - start_time, traceback.format_exc()
+
+
+def run_status(simulation_parameters: SimulationParameters):
+    """
+    :param simulation_parameters: parameters of the simulation
+    :return: 'completed' if the simulation finished with the same parameters and unchanged outputs, 'resumable' if
+             it was interrupted after a checkpoint with the same parameters, 'partial' if the output directory exists
+             without valid completion marker or checkpoint, 'pending' otherwise
+    """
+    if is_completed(simulation_parameters.output_path, simulation_parameters.hash()):
+        return 'completed'
+    if is_resumable(checkpoint_filename(simulation_parameters.output_path), simulation_parameters):
+        return 'resumable'
+    if os.path.isdir(simulation_parameters.output_path):
+        return 'partial'
+    return 'pending'
+
+
+def write_manifest(manifest: pd.DataFrame, filename):
+    """
+    Writes the manifest, the file is replaced atomically.
+    :param manifest: state of all simulations of the sweep
+    :param filename: file of the manifest
+    """
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    tmp_filename = '{}.tmp'.format(filename)
+    manifest.to_csv(tmp_filename, index=False)
+    os.replace(tmp_filename, filename)
+
+
+def run_sweep(parameters, processes: int, manifest_filename):
+    """
+    Runs all simulations in a pool of worker processes. Simulations which already completed with the same parameters
+    (see IO.is_completed) are skipped, interrupted simulations continue from their checkpoint or are run again if
+    there is none. The simulations with the longest expected
+    run time are submitted first and dispatched one by one to the next free worker, hence few long simulations at the
+    end do not leave the other workers idle. State, run time and errors of all simulations are recorded in the
+    manifest, hence a sweep is resumed by running it again.
+    :param parameters: parameters of the simulations
+    :param processes: number of worker processes
+    :param manifest_filename: file of the manifest (csv)
+    :return: manifest
+    """
+    manifest = pd.DataFrame({'output_path': [para.output_path for para in parameters],
+                             'expected_cost': [expected_cost(para) for para in parameters],
+                             'status': [run_status(para) for para in parameters],
+                             'runtime': 0.,
+                             'error': ''})
+    write_manifest(manifest, manifest_filename)
+
+    files = sorted(set(para.file for para in parameters))
+    cache_path = parameters[0].cache_path if parameters else '.cache'
+
+    # geometry and visibility are computed once, all simulations read them from the cache
+    for file in files:
+        init_cache(file, cache_path)
+
+    remaining = manifest[manifest['status'] != 'completed']
+    print('{} completed, {} resumable, {} partial, {} pending, remaining expected cost {:.0f}%'.format(
+        (manifest['status'] == 'completed').sum(), (manifest['status'] == 'resumable').sum(),
+        (manifest['status'] == 'partial').sum(), (manifest['status'] == 'pending').sum(),
+        100 * remaining['expected_cost'].sum() / max(manifest['expected_cost'].sum(), 1)))
+
+    order = remaining['expected_cost'].sort_values(ascending=False, kind='stable').index
+    for index in remaining.index[remaining['status'] == 'resumable']:
+        parameters[index].resume = checkpoint_filename(parameters[index].output_path)
+    tasks = [(index, parameters[index]) for index in order]
+
+    start_time = time.time()
+    with multiprocessing.Pool(processes, initializer=init_worker, initargs=(files, cache_path)) as pool:
+        for finished, (index, status, runtime, error) in enumerate(pool.imap_unordered(run_task, tasks, chunksize=1),
+                                                                   start=1):
+            manifest.loc[index, ['status', 'runtime', 'error']] = [status, runtime, error]
+            write_manifest(manifest, manifest_filename)
+
+            elapsed = time.time() - start_time
+            print('{:>6} {} ({:.1f}s), {}/{} finished, {:.1f} runs/h'.format(
+                status, manifest.loc[index, 'output_path'], runtime, finished, len(tasks), finished / elapsed * 3600))
+            if status == 'failed':
+                print(error)
+
+    print('{} done, {} failed, {} completed before, manifest: {}'.format(
+        (manifest['status'] == 'done').sum(), (manifest['status'] == 'failed').sum(),
+        (manifest['status'] == 'completed').sum(), manifest_filename))
+    return manifest
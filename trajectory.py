@@ -1,31 +1,46 @@
 from dataclasses import dataclass
 from typing import Dict
 import pandas as pd
-from pedestrian import Pedestrian
+from pedestrian import PedestrianStore
 from grid import Grid
 
+import glob
 import numpy as np
 import os
 
+TRAJECTORY_CHUNK_SIZE = 65536
+"""Number of trajectory rows kept in memory before they are flushed to disk."""
+
 
 @dataclass
 class Trajectory:
     """
-    Class containing the trajectory data
+    Class containing the trajectory data, stored column wise in preallocated arrays which are flushed to disk in
+    chunks.
     """
-    traj = pd.DataFrame(columns=['step', 'id', 'x', 'y', 'exit'])
+    columns = ['step', 'id', 'i', 'j', 'exit']
+    data: Dict[str, np.ndarray]
+    size: int
+    num_chunks: int
     space_usage = None
+    snapshot_interval: int
 
-    def __init__(self, grid: Grid, num_steps: int):
+    def __init__(self, grid: Grid, snapshot_interval: int = 0, chunk_size: int = TRAJECTORY_CHUNK_SIZE):
         """
         Constructor
         :param grid: grid to use
-        :param num_steps: number of compute steps
+        :param snapshot_interval: the space usage is written every snapshot_interval steps, 0 for no snapshots
+        :param chunk_size: number of rows kept in memory before flushing
         """
-        shape = (num_steps, grid.gridX.shape[0], grid.gridX.shape[1])
-        self.space_usage = np.zeros(shape)
+        self.data = {column: np.zeros(chunk_size, dtype=np.int32) for column in self.columns}
+        self.size = 0
+        self.num_chunks = 0
+
+        # number of steps each cell was occupied
+        self.space_usage = np.zeros(grid.gridX.shape, dtype=np.int32)
+        self.snapshot_interval = snapshot_interval
 
-    def add_step(self, step: int, grid: Grid, peds: Dict[int, Pedestrian], output_path):
+    def add_step(self, step: int, grid: Grid, peds: PedestrianStore, output_path):
         """
         Append trajectory data.
         :param step: Current time step
@@ -33,40 +48,154 @@ class Trajectory:
         :param peds: Pedestrians in simulation
         :param output_path: output_path
         """
-        step_frame = pd.DataFrame(columns=['step', 'id', 'x', 'y', 'exit'])
-        for key, ped in peds.items():
-            # add trajectory
-            x, y = grid.get_coordinates(ped.pos[0], ped.pos[1])
-            step_frame_ped = {'step': step, 'id': key, 'x': x, 'y': y, 'exit': ped.exit_id}
-            step_frame = step_frame.append(step_frame_ped, ignore_index=True)
+        num_peds = len(peds)
+        capacity = len(self.data['step'])
+        if self.size + num_peds > capacity:
+            self.flush(output_path)
+            if num_peds > capacity:
+                self.data = {column: np.zeros(num_peds, dtype=np.int32) for column in self.columns}
+
+        ids = peds.get_ids()
+        pos = peds.positions()
+        exits = peds.exit_ids()
+
+        rows = slice(self.size, self.size + num_peds)
+        self.data['step'][rows] = step
+        self.data['id'][rows] = ids
+        self.data['i'][rows] = pos[:, 0]
+        self.data['j'][rows] = pos[:, 1]
+        self.data['exit'][rows] = exits
+        self.size += num_peds
+
+        # update space usage
+        np.add.at(self.space_usage, (pos[:, 0], pos[:, 1]), 1)
+        if self.snapshot_interval > 0 and (step + 1) % self.snapshot_interval == 0:
+            self.save_space_usage_snapshot(output_path, step)
+
+    def save_space_usage_snapshot(self, output_path, step: int):
+        """
+        Writes the current space usage of all used cells (sparse) to the output directory.
+        :param output_path: output directory
+        :param step: Current time step
+        """
+        i, j = np.nonzero(self.space_usage)
+        snapshot_filename = os.path.join(output_path, 'space_usage-{:05d}.npz'.format(step))
+        np.savez_compressed(snapshot_filename, i=i.astype(np.int32), j=j.astype(np.int32),
+                            count=self.space_usage[i, j], shape=np.asarray(self.space_usage.shape))
+
+    def flush(self, output_path):
+        """
+        Writes the trajectory rows in memory as new chunk to the output directory.
+        :param output_path: output directory
+        """
+        if self.size == 0:
+            return
+
+        chunk_filename = self.chunk_filename(output_path, self.num_chunks)
+        np.savez(chunk_filename, **{column: values[:self.size] for column, values in self.data.items()})
+        self.num_chunks += 1
+        self.size = 0
+
+    def state(self):
+        """
+        :return: arrays describing the trajectory in memory (rows not flushed yet, number of chunks on disk and space
+                 usage), the chunks on disk are not included
+        """
+        state = {column: values[:self.size] for column, values in self.data.items()}
+        state['capacity'] = np.asarray(len(self.data['step']))
+        state['num_chunks'] = np.asarray(self.num_chunks)
+        state['space_usage'] = self.space_usage
+        return state
 
-            # update space usage
-            if step != 0:
-                self.space_usage[step][ped.pos[0]][ped.pos[1]] = self.space_usage[step - 1][ped.pos[0]][ped.pos[1]] + 1
-            else:
-                self.space_usage[step][ped.pos[0]][ped.pos[1]] = self.space_usage[0][ped.pos[0]][ped.pos[1]] + 1
+    def set_state(self, state):
+        """
+        Restores the trajectory in memory, later chunks on disk are overwritten by the next flush.
+        :param state: arrays describing the trajectory (see state())
+        """
+        self.data = {column: np.zeros(int(state['capacity']), dtype=np.int32) for column in self.columns}
+        self.size = len(state['step'])
+        for column in self.columns:
+            self.data[column][:self.size] = state[column]
+        self.num_chunks = int(state['num_chunks'])
+        self.space_usage = np.array(state['space_usage'], dtype=np.int32)
 
-        traj_filename = os.path.join(output_path, 'traj.csv')
+    def remove_stale_outputs(self, output_path, first_step: int):
+        """
+        Removes the outputs of an earlier (e.g., crashed) run in the output directory, which this run does not
+        overwrite: chunks after the chunks of this trajectory, space usage snapshots from first_step on and the
+        combined trajectory files. Otherwise they would be listed as outputs of this run by the completion marker.
+        :param output_path: output directory
+        :param first_step: first step computed by this run (0 or the step of the checkpoint)
+        """
+        stale = [os.path.join(output_path, filename) for filename in ['traj.npz', 'traj.csv', 'space_usage.txt']]
+        for filename in glob.glob(os.path.join(output_path, 'traj-*.npz')):
+            if int(os.path.basename(filename)[len('traj-'):-len('.npz')]) >= self.num_chunks:
+                stale.append(filename)
+        for filename in glob.glob(os.path.join(output_path, 'space_usage-*.npz')):
+            if int(os.path.basename(filename)[len('space_usage-'):-len('.npz')]) >= first_step:
+                stale.append(filename)
 
-        if step == 0:
-            with open(traj_filename, 'w') as f:
-                step_frame.to_csv(f, header=True, index=False)
-        else:
-            with open(traj_filename, 'a') as f:
-                step_frame.to_csv(f, header=False, index=False)
+        for filename in stale:
+            if os.path.isfile(filename):
+                os.remove(filename)
 
-        self.traj = self.traj.append(step_frame, ignore_index=True)
+    @staticmethod
+    def chunk_filename(output_path, chunk: int):
+        """
+        :param output_path: output directory
+        :param chunk: number of the chunk
+        :return: file name of the chunk
+        """
+        return os.path.join(output_path, 'traj-{:05d}.npz'.format(chunk))
 
-    def save(self, output_path):
+    def save(self, output_path, grid: Grid, csv: bool = False):
         """
-        Saves the current state of the trajectory
+        Saves the current state of the trajectory, the chunks are combined to one file.
         :param output_path: output directory
+        :param grid: Grid to use
+        :param csv: if True, the trajectory is also exported as csv file
         """
-        traj_filename = os.path.join(output_path, 'traj.csv')
-        self.traj.to_csv(traj_filename)
+        self.flush(output_path)
 
-        step = self.space_usage.shape[0] - 1
+        chunk_filenames = [self.chunk_filename(output_path, chunk) for chunk in range(self.num_chunks)]
+        traj = Trajectory.read_chunks(chunk_filenames)
+        np.savez_compressed(os.path.join(output_path, 'traj.npz'), **traj)
+        for chunk_filename in chunk_filenames:
+            os.remove(chunk_filename)
+
+        if csv:
+            Trajectory.export_csv(traj, grid, os.path.join(output_path, 'traj.csv'))
 
         suffix = 'space_usage.txt'
         su_filename = os.path.join(output_path, suffix)
-        np.savetxt(su_filename, self.space_usage[step])
+        np.savetxt(su_filename, self.space_usage, fmt='%d')
+
+    @staticmethod
+    def read_chunks(chunk_filenames):
+        """
+        Reads the trajectory from the given chunks.
+        :param chunk_filenames: files of the chunks in order
+        :return: trajectory data (column -> values)
+        """
+        traj = {column: [np.zeros(0, dtype=np.int32)] for column in Trajectory.columns}
+        for chunk_filename in chunk_filenames:
+            with np.load(chunk_filename) as chunk:
+                for column in Trajectory.columns:
+                    traj[column].append(chunk[column])
+
+        return {column: np.concatenate(values) for column, values in traj.items()}
+
+    @staticmethod
+    def export_csv(traj, grid: Grid, filename):
+        """
+        Exports the trajectory with the coordinates of the cells as csv file.
+        :param traj: trajectory data (column -> values)
+        :param grid: Grid to use
+        :param filename: csv file
+        """
+        df = pd.DataFrame({'step': traj['step'],
+                           'id': traj['id'],
+                           'x': grid.gridX[traj['i'], traj['j']],
+                           'y': grid.gridY[traj['i'], traj['j']],
+                           'exit': traj['exit']})
+        df.to_csv(filename, index=False)
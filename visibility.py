@@ -0,0 +1,178 @@
+import os
+
+import numpy as np
+from matplotlib.path import Path
+from shapely.geometry import Polygon
+
+from geometry import Geometry
+from grid import Grid
+
+
+class VisibilityCache:
+    """
+    Cache for the visible areas of the grid cells. Pedestrians only stand on cell centers of a static geometry, hence
+    the visible area only depends on the cell. The cache is filled lazily and stored on disk, keyed by the geometry
+    hash and cell size.
+    """
+
+    def __init__(self, geometry: Geometry, grid: Grid, cache_path: str):
+        """
+        Init the cache, loads already computed visible areas from cache_path.
+        :param geometry: geometry to use
+        :param grid: grid to use
+        :param cache_path: directory where the cache is stored
+        """
+        self.geometry = geometry
+        self.grid = grid
+        self.filename = os.path.join(cache_path,
+                                     'visibility_{}_{:d}.npz'.format(geometry.hash, int(grid.cellsize)))
+        self.points = {}
+        self.polygons = {}
+        self.modified = False
+        self.load()
+
+    def visible_area(self, i: int, j: int):
+        """
+        :param i: 1st dimension index of cell
+        :param j: 2nd dimension index of cell
+        :return: Visible area from the center of cell (i, j)
+        """
+        cell = (int(i), int(j))
+        if cell not in self.polygons:
+            if cell not in self.points:
+                x, y = self.grid.get_coordinates(i, j)
+                self.points[cell] = np.asarray(self.geometry.visible_area(x, y).exterior.coords)
+                self.modified = True
+            self.polygons[cell] = Polygon(self.points[cell])
+
+        return self.polygons[cell]
+
+    def load(self):
+        """
+        Loads the visible areas from the cache file, if it exists.
+        """
+        if not os.path.isfile(self.filename):
+            return
+
+        with np.load(self.filename) as data:
+            cells = data['cells']
+            offsets = data['offsets']
+            points = data['points']
+
+        for index, cell in enumerate(cells):
+            self.points[(int(cell[0]), int(cell[1]))] = points[offsets[index]:offsets[index + 1]]
+
+    def save(self):
+        """
+        Saves the visible areas to the cache file, if new ones have been computed.
+        """
+        if not self.modified:
+            return
+
+        cells = np.asarray(list(self.points.keys()), dtype=int).reshape(-1, 2)
+        lengths = [len(points) for points in self.points.values()]
+        offsets = np.concatenate(([0], np.cumsum(lengths))).astype(int)
+        points = np.concatenate(list(self.points.values())) if self.points else np.zeros((0, 2))
+
+        os.makedirs(os.path.dirname(self.filename) or '.', exist_ok=True)
+
+        # write to temporary file first, so concurrent simulations never read incomplete caches
+        tmp_filename = '{}.{}.tmp.npz'.format(self.filename[:-len('.npz')], os.getpid())
+        np.savez_compressed(tmp_filename, cells=cells, offsets=offsets, points=points)
+        os.replace(tmp_filename, self.filename)
+        self.modified = False
+
+
+class VisibilityIndex:
+    """
+    Cell to cell visibility of all walkable cells, stored as packed bitset per cell. Bit k of the row of a cell is set
+    if the center of the k-th walkable cell lies inside the visible area of the cell. The index is built once per
+    geometry from the visible areas and memory mapped from the cache.
+    """
+
+    def __init__(self, geometry: Geometry, grid: Grid, cache_path: str):
+        """
+        Init the index, builds it if it is not in the cache yet.
+        :param geometry: geometry to use
+        :param grid: grid to use
+        :param cache_path: directory where the index is stored
+        """
+        self.grid = grid
+        self.inside = grid.inside_cells == 1
+
+        walkable = np.logical_or(self.inside, grid.entrance_cells == 1)
+        self.cells = np.argwhere(walkable)
+        self.cell_index = np.full(grid.gridX.shape, -1, dtype=int)
+        self.cell_index[self.cells[:, 0], self.cells[:, 1]] = np.arange(len(self.cells))
+        self.inside_bits = np.packbits(self.inside[self.cells[:, 0], self.cells[:, 1]])
+        self.cells_i = np.ascontiguousarray(self.cells[:, 0])
+        self.cells_j = np.ascontiguousarray(self.cells[:, 1])
+
+        self.filename = os.path.join(cache_path,
+                                     'visibility-index_{}_{:d}.npy'.format(geometry.hash, int(grid.cellsize)))
+        if not os.path.isfile(self.filename):
+            self.build(VisibilityCache(geometry, grid, cache_path))
+
+        self.bits = np.load(self.filename, mmap_mode='r')
+
+    def build(self, visibility: VisibilityCache):
+        """
+        Builds the index from the visible areas and stores it in the cache.
+        :param visibility: visible areas of the cells
+        """
+        points_x = self.grid.gridX[self.cells[:, 0], self.cells[:, 1]]
+        points_y = self.grid.gridY[self.cells[:, 0], self.cells[:, 1]]
+
+        bits = np.zeros((len(self.cells), (len(self.cells) + 7) // 8), dtype=np.uint8)
+        for index, (i, j) in enumerate(self.cells):
+            area = visibility.visible_area(i, j)
+            minx, miny, maxx, maxy = area.bounds
+
+            # only check cells in bounding box of visible area
+            candidates = np.where((points_x >= minx) & (points_x <= maxx)
+                                  & (points_y >= miny) & (points_y <= maxy))[0]
+            path = Path(np.asarray(area.exterior.coords), closed=True)
+            inside = path.contains_points(np.column_stack((points_x[candidates], points_y[candidates])))
+
+            row = np.zeros(len(self.cells), dtype=bool)
+            row[candidates[inside]] = True
+            bits[index] = np.packbits(row)
+
+        visibility.save()
+
+        os.makedirs(os.path.dirname(self.filename) or '.', exist_ok=True)
+        tmp_filename = '{}.{}.tmp.npy'.format(self.filename[:-len('.npy')], os.getpid())
+        np.save(tmp_filename, bits)
+        os.replace(tmp_filename, self.filename)
+
+    def visible_window(self, i: int, j: int, radius: float = 0):
+        """
+        :param i: 1st dimension index of cell
+        :param j: 2nd dimension index of cell
+        :param radius: only cells within radius (in number of cells) are considered, 0 for no limit
+        :return: window (slices of the grid) as bounding box of cell (i, j) and the inside cells visible from it,
+                 matrix with True for the visible cells in the window, False otherwise
+        """
+        row = np.unpackbits(self.bits[self.cell_index[i, j]] & self.inside_bits, count=len(self.cells))
+        visible = np.flatnonzero(row)
+        visible_i = self.cells_i[visible]
+        visible_j = self.cells_j[visible]
+        if radius > 0:
+            near = (visible_i - i) ** 2 + (visible_j - j) ** 2 <= radius ** 2
+            visible_i = visible_i[near]
+            visible_j = visible_j[near]
+
+        if len(visible_i) == 0:
+            return (slice(i, i + 1), slice(j, j + 1)), np.zeros((1, 1), dtype=bool)
+
+        lower_i, upper_i = min(visible_i.min(), i), max(visible_i.max(), i) + 1
+        lower_j, upper_j = min(visible_j.min(), j), max(visible_j.max(), j) + 1
+        cells = np.zeros((upper_i - lower_i, upper_j - lower_j), dtype=bool)
+        cells[visible_i - lower_i, visible_j - lower_j] = True
+        return (slice(lower_i, upper_i), slice(lower_j, upper_j)), cells
+
+    def nbytes(self):
+        """
+        :return: size of the index in bytes
+        """
+        return self.bits.nbytes
@@ -45,6 +45,31 @@ def restricted_bool(x):
     return x
 
 
+def restricted_sigmoid_error(x):
+    """
+    Checks if the given parameter x is a floating point literal in [0, 0.5), if so returns it.
+    :param x: value to check
+    :return: x as floating-point literal
+    """
+    x = restricted_float(x)
+    if not 0 <= x < 0.5:
+        raise argparse.ArgumentTypeError("%r not in [0, 0.5)" % (x,))
+    return x
+
+
+def strict_bool(x):
+    """
+    Checks if the given parameter x is 'true' or 'false' (case insensitive), if so returns it.
+    :param x: value to check
+    :return: x as boolean
+    """
+    if x.lower() == 'true':
+        return True
+    if x.lower() == 'false':
+        return False
+    raise argparse.ArgumentTypeError("%r not 'true' or 'false'" % (x,))
+
+
 def setup_argument_parser():
     """
     Set-up argument parser
@@ -80,11 +105,48 @@ def setup_argument_parser():
                         default=1)
     parser.add_argument('--ped_c', help='sigmoid parameter for pedestrian c (default 1)', type=restricted_float,
                         default=0.75)
+    parser.add_argument('--shared_ped_field', help='compute the pedestrian distance once per step for all '
+                                                   'pedestrians instead of once per pedestrian',
+                        type=strict_bool, default=False)
+    parser.add_argument('--sigmoid_error', help='max error of the sigmoid lookup table for the pedestrian field '
+                                                '(default 0, exact sigmoid), below 0.5', type=restricted_sigmoid_error,
+                        default=0)
+
+    # read distance backends: fmm (fast marching), edt (straight line, ignores obstacles) or graph (shortest paths)
+    parser.add_argument('--ped_distance_backend', help='method computing the pedestrian distance (default fmm)',
+                        choices=['fmm', 'edt', 'graph'], default='fmm')
+    parser.add_argument('--wall_distance_backend', help='method computing the wall distance (default fmm)',
+                        choices=['fmm', 'edt', 'graph'], default='fmm')
+    parser.add_argument('--exit_distance_backend', help='method computing the exit distance (default fmm)',
+                        choices=['fmm', 'edt', 'graph'], default='fmm')
+    parser.add_argument('--entrance_distance_backend', help='method computing the entrance distance (default fmm)',
+                        choices=['fmm', 'edt', 'graph'], default='fmm')
+
+    parser.add_argument('--window_radius', help='only consider cells within this radius (in m) for the neighbor '
+                                                'probabilities (default 0, all visible cells)',
+                        type=restricted_float, default=0)
+    parser.add_argument('--step_workers', help='number of processes computing the pedestrians of one step, results '
+                                               'are identical to the serial computation (default 1, serial)',
+                        type=restricted_int, default=1)
+    parser.add_argument('--step_kernel', help='compute the next steps with the compiled kernel, needs numba and '
+                                              '--shared_ped_field (default False)', type=strict_bool,
+                        default=False)
 
     parser.add_argument('--plot', help='plot the static ff, and peds in each step', type=restricted_bool,
                         default=False)
 
+    parser.add_argument('--traj_csv', help='additionally export the trajectory as csv file', type=strict_bool,
+                        default=False)
+
+    parser.add_argument('--space_usage_interval', help='write snapshots of the space usage every n steps '
+                                                       '(default 0, no snapshots)', type=restricted_int, default=0)
+    parser.add_argument('--checkpoint_interval', help='write a checkpoint every n steps to the output directory '
+                                                      '(default 0, no checkpoints)', type=restricted_int, default=0)
+    parser.add_argument('--resume', help='checkpoint to resume the simulation from, the parameters have to be the '
+                                         'same as in the interrupted simulation', default='')
     parser.add_argument('--output_path', help='directory where the results are stored', default='results')
+    parser.add_argument('--cache_path', help='directory where precomputed geometry data is cached',
+                        default='.cache')
 
     return parser
 